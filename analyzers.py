@@ -0,0 +1,683 @@
+import re
+import functools
+from collections import namedtuple
+
+from profiling import timed
+
+# Language analyzers working on Pygments token streams. A file is tokenized
+# once (see `tokenize`) and the same tokens feed highlighting, structure
+# analysis and security scanning. Each language registers an analyzer class
+# describing its keywords, import syntax, dangerous APIs and test template.
+
+# A significant token: whitespace and comments dropped, adjacent string
+# pieces merged, punctuation split into single characters
+Tok = namedtuple("Tok", "kind value line ttype")
+
+# Multi-character punctuation kept whole
+_COMPOUND_PUNCTUATION = ("=>", "::", "->", "...")
+
+_CONTROL_KEYWORDS = {
+    "if", "for", "while", "switch", "catch", "return", "elif", "else", "do", "foreach",
+    "using", "lock", "fixed", "sizeof", "typeof", "new", "await", "match", "with", "synchronized"
+}
+
+_SQL_RE = re.compile(r"\b(SELECT\s.+\sFROM|INSERT\s+INTO|UPDATE\s.+\sSET|DELETE\s+FROM)\b", re.IGNORECASE | re.DOTALL)
+_SECRET_NAME_RE = re.compile(r"(pass(word|wd)?|secret|api_?key|access_?key|auth_?token|private_?key)$", re.IGNORECASE)
+
+_analyzers = {}
+
+
+def register_analyzer(cls):
+    """
+    Class decorator registering an analyzer for each of its `languages`
+    """
+    instance = cls()
+    for language in cls.languages:
+        _analyzers[language] = instance
+    return cls
+
+
+@functools.lru_cache(maxsize=64)
+def _lexer_for(language):
+    """
+    Pygments lexer for a language name, or None if Pygments does not know it
+    """
+    from pygments.lexers import get_lexer_by_name
+
+    try:
+        # startinline is only read by the PHP lexer: pasted snippets rarely
+        # start with "<?php" and would otherwise be lexed as inline HTML
+        return get_lexer_by_name(language, stripall=True, startinline=True)
+    except Exception as lexer_error:
+        print(f"Lexer error for language '{language}': {str(lexer_error)}")
+        return None
+
+
+@functools.lru_cache(maxsize=32)
+def tokenize(code, language):
+    """
+    Pygments tokens for the code, cached so highlighting, analysis and the
+    security scan of the same code share a single tokenization
+    """
+    with timed("tokenize"):
+        # Fallback to python if language not found, as for highlighting
+        lexer = _lexer_for(language) or _lexer_for("python")
+        return tuple(lexer.get_tokens(code))
+
+
+def get_analyzer(language):
+    """
+    Analyzer for a language name or any of its Pygments aliases. Unknown
+    languages get the generic analyzer, not the one of the fallback lexer.
+    """
+    analyzer = _analyzers.get(language)
+    lexer = _lexer_for(language)
+    if analyzer is None and lexer is not None:
+        for alias in lexer.aliases:
+            if alias in _analyzers:
+                analyzer = _analyzers[alias]
+                break
+    return analyzer or GenericAnalyzer.instance
+
+
+def significant_tokens(code, language):
+    """
+    Tokens without whitespace and comments, with line numbers
+    """
+    from pygments.token import Comment, Punctuation, String, Keyword, Name, Number, Operator
+
+    # The lexer strips leading whitespace, so count the lines it removed
+    line = code[:len(code) - len(code.lstrip())].count("\n") + 1
+    result = []
+    for ttype, value in tokenize(code, language):
+        if ttype in Comment.PreprocFile or ttype in Comment.Preproc:
+            kind = "preproc"
+        elif ttype in Comment or not value.strip():
+            kind = None
+        elif ttype in String:
+            kind = "string"
+        elif ttype in Keyword or ttype in Operator.Word:
+            kind = "keyword"
+        elif ttype in Name:
+            kind = "name"
+        elif ttype in Number:
+            kind = "number"
+        elif ttype in Punctuation or ttype in Operator:
+            kind = "punct"
+        else:
+            kind = "other"
+
+        if kind == "string" and result and result[-1].kind == "string" and result[-1].line == line:
+            previous = result[-1]
+            result[-1] = previous._replace(value=previous.value + value)
+        elif kind == "punct" and value.strip() not in _COMPOUND_PUNCTUATION and len(value.strip()) > 1 \
+                and ttype in Punctuation:
+            result.extend(Tok(kind, char, line, ttype) for char in value.strip() if not char.isspace())
+        elif kind is not None:
+            result.append(Tok(kind, value.strip() if kind != "string" else value, line, ttype))
+        line += value.count("\n")
+    return result
+
+
+def _matching(tokens, start, open_char="(", close_char=")"):
+    # Index of the bracket closing tokens[start], or None
+    depth = 0
+    for i in range(start, len(tokens)):
+        if tokens[i].kind == "punct":
+            if tokens[i].value == open_char:
+                depth += 1
+            elif tokens[i].value == close_char:
+                depth -= 1
+                if depth == 0:
+                    return i
+    return None
+
+
+def _strip_quotes(value):
+    return value.strip().strip("'\"`<>")
+
+
+class LanguageAnalyzer:
+    """
+    Base analyzer for brace-delimited languages; subclasses set the
+    language-specific keywords and rules
+    """
+
+    languages = ()
+    # Keywords directly followed by the name they define
+    function_keywords = {"function"}
+    class_keywords = {"class", "struct", "interface", "enum", "trait"}
+    import_keywords = {"import"}
+    # Where the parameter name is in "int a" (last) vs "a: int" / "a int" (first)
+    param_name = "last"
+    block_style = "braces"
+    indent_unit = 4
+    # Calls flagged by the security scan, by (possibly dotted) callee name
+    dangerous_calls = {}
+    # Imports flagged by the security scan
+    dangerous_imports = {}
+    # Property assignments flagged by the security scan, e.g. innerHTML
+    dangerous_assignments = {}
+    test_file_header = None
+
+    def structure(self, code, language):
+        tokens = significant_tokens(code, language)
+        functions = [name for name, _ in self.functions(tokens)]
+        return {
+            "functions": functions,
+            "classes": self.classes(tokens),
+            "imports": self.imports(tokens),
+            "loc": len(code.split('\n'))
+        }
+
+    def complexity(self, code, language):
+        """
+        Deepest nesting level, as a simple complexity metric
+        """
+        if self.block_style == "indent":
+            max_indent = 0
+            for line in code.split('\n'):
+                if line.strip() and not line.strip().startswith('#'):
+                    indent = len(line) - len(line.lstrip())
+                    max_indent = max(max_indent, indent // self.indent_unit)
+            return max_indent
+
+        depth = max_depth = 0
+        for tok in significant_tokens(code, language):
+            if tok.kind == "punct" and tok.value == "{":
+                depth += 1
+                max_depth = max(max_depth, depth)
+            elif tok.kind == "punct" and tok.value == "}":
+                depth = max(0, depth - 1)
+        return max_depth
+
+    def functions(self, tokens):
+        """
+        (name, parameter names) of the functions and methods defined
+        """
+        from pygments.token import Name
+
+        found = []
+        seen = set()
+        for i, tok in enumerate(tokens):
+            if tok.kind != "name" or i in seen:
+                continue
+            previous = tokens[i - 1] if i else None
+            following = tokens[i + 1] if i + 1 < len(tokens) else None
+            is_definition = tok.ttype in Name.Function or (
+                previous is not None and previous.value in self.function_keywords
+            )
+            if not is_definition and following is not None and following.value == "=":
+                # name = function (...) / name = (...) =>
+                after = tokens[i + 2] if i + 2 < len(tokens) else None
+                if after is not None and after.value in self.function_keywords:
+                    is_definition = True
+                elif after is not None and after.value == "(":
+                    end = _matching(tokens, i + 2)
+                    is_definition = end is not None and end + 1 < len(tokens) and tokens[end + 1].value == "=>"
+                if is_definition:
+                    paren = i + 2 if tokens[i + 2].value == "(" else i + 3
+                    found.append((tok.value, self._params(tokens, paren)))
+                    seen.add(i)
+                    continue
+            if not is_definition and following is not None and following.value == "(" \
+                    and tok.value not in _CONTROL_KEYWORDS and self.block_style == "braces":
+                # name(...) [: type | throws X | -> T] {   (methods without a keyword)
+                end = _matching(tokens, i + 1)
+                if end is not None and (previous is None or previous.value not in (".", "new", "=", "return")):
+                    for j in range(end + 1, min(end + 8, len(tokens))):
+                        if tokens[j].value in ("{", ";", "(", "=", "=>"):
+                            is_definition = tokens[j].value == "{"
+                            break
+            if is_definition and following is not None and following.value == "(":
+                found.append((tok.value, self._params(tokens, i + 1)))
+                seen.add(i)
+            elif is_definition and tok.ttype in Name.Function:
+                found.append((tok.value, []))
+                seen.add(i)
+        return found
+
+    def _params(self, tokens, open_index):
+        end = _matching(tokens, open_index)
+        if end is None:
+            return []
+        params, segment, depth = [], [], 0
+        for tok in tokens[open_index + 1:end] + [Tok("punct", ",", 0, None)]:
+            if tok.kind == "punct" and tok.value in "([{<":
+                depth += 1
+            elif tok.kind == "punct" and tok.value in ")]}>":
+                depth -= 1
+            if tok.kind == "punct" and tok.value == "," and depth == 0:
+                names = []
+                for part in segment:
+                    if part.kind == "punct" and part.value in ("=", ":"):
+                        if part.value == "=" or self.param_name == "first":
+                            break
+                        names = [names[-1]] if names else []
+                        break
+                    if part.kind == "name":
+                        names.append(part.value)
+                if names:
+                    params.append(names[0] if self.param_name == "first" else names[-1])
+                segment = []
+            else:
+                segment.append(tok)
+        return params
+
+    def classes(self, tokens):
+        from pygments.token import Name
+
+        classes = []
+        for i, tok in enumerate(tokens):
+            if tok.kind != "name":
+                continue
+            if tok.ttype in Name.Class or (i and tokens[i - 1].value in self.class_keywords):
+                if tok.value not in classes:
+                    classes.append(tok.value)
+        return classes
+
+    def imports(self, tokens):
+        from pygments.token import Comment, Name
+
+        imports = []
+        i = 0
+        while i < len(tokens):
+            tok = tokens[i]
+            if tok.kind == "preproc" and tok.ttype in Comment.PreprocFile:
+                imports.append(_strip_quotes(tok.value))
+            elif tok.value in self.import_keywords and tok.kind in ("keyword", "name"):
+                # The rest of the statement: up to ';' or the end of the line
+                j = i + 1
+                statement = []
+                grouped = j < len(tokens) and tokens[j].value == "(" and _matching(tokens, j)
+                if grouped:
+                    # Grouped imports: import ( "a" "b" )
+                    statement = tokens[j + 1:grouped]
+                    j = grouped + 1
+                while not grouped and j < len(tokens) and tokens[j].value != ";" and (
+                        tokens[j].line == tok.line or statement and statement[-1].value in ("(", ",", "{")
+                        or tokens[j].value == ")"):
+                    statement.append(tokens[j])
+                    j += 1
+                strings = [_strip_quotes(t.value) for t in statement if t.kind == "string"]
+                namespaces = [t.value for t in statement if t.ttype is not None and t.ttype in Name.Namespace]
+                if strings:
+                    imports.extend(strings)
+                elif namespaces:
+                    imports.extend(namespaces)
+                else:
+                    dotted = ""
+                    for t in statement:
+                        if t.kind == "name" or t.value in (".", "::", "\\"):
+                            dotted += t.value
+                        elif dotted:
+                            break
+                    if dotted:
+                        imports.append(dotted)
+                i = j
+                continue
+            i += 1
+        return imports
+
+    def security_issues(self, code, language):
+        tokens = significant_tokens(code, language)
+        issues = []
+        issues.extend(self._dangerous_calls(tokens))
+        issues.extend(self._dangerous_imports(tokens))
+        issues.extend(self._hardcoded_secrets(tokens))
+        issues.extend(self._sql_injection(tokens))
+        # One finding per rule and line
+        unique, seen = [], set()
+        for issue in issues:
+            key = (issue["type"], issue["description"], issue["line"])
+            if key not in seen:
+                seen.add(key)
+                unique.append(issue)
+        return unique
+
+    def _issue(self, rule, line):
+        issue_type, severity, description = rule
+        return {"type": issue_type, "severity": severity, "description": description, "line": line}
+
+    def _callee(self, tokens, index):
+        # Dotted name ending at tokens[index]: a.b.c
+        parts = [tokens[index].value]
+        j = index - 1
+        while j >= 1 and tokens[j].value in (".", "::", "->") and tokens[j - 1].kind == "name":
+            parts.insert(0, tokens[j - 1].value)
+            j -= 2
+        return ".".join(parts)
+
+    def _dangerous_calls(self, tokens):
+        for i, tok in enumerate(tokens[:-1]):
+            if tok.kind not in ("name", "keyword") or tokens[i + 1].value != "(":
+                continue
+            callee = self._callee(tokens, i)
+            for pattern, rule in self.dangerous_calls.items():
+                if callee == pattern or callee.endswith("." + pattern):
+                    yield self._issue(rule, tok.line)
+        for i, tok in enumerate(tokens[:-1]):
+            if tok.value in self.dangerous_assignments and tokens[i + 1].value in ("=", "+="):
+                if i and tokens[i - 1].value == ".":
+                    yield self._issue(self.dangerous_assignments[tok.value], tok.line)
+
+    def _dangerous_imports(self, tokens):
+        if not self.dangerous_imports:
+            return
+        for module in self.imports(tokens):
+            for pattern, rule in self.dangerous_imports.items():
+                if module == pattern or module.startswith(pattern + "."):
+                    # Dotted modules may be split into several tokens: find the first piece
+                    head = module.split(".")[0]
+                    line = next((t.line for t in tokens if _strip_quotes(t.value) in (module, head)), None) \
+                        or next((t.line for t in tokens if module.endswith(_strip_quotes(t.value))), 1)
+                    yield self._issue(rule, line)
+
+    def _hardcoded_secrets(self, tokens):
+        rule = ("Hardcoded Credentials", "High",
+                "Hardcoded password detected. Use environment variables or a secure vault instead.")
+        for i, tok in enumerate(tokens[:-2]):
+            name = tok.value.lstrip("$").strip("'\"")
+            if tok.kind not in ("name", "string") or not _SECRET_NAME_RE.search(name):
+                continue
+            if tokens[i + 1].value in ("=", ":", "=>", ":=") and tokens[i + 2].kind == "string" \
+                    and len(_strip_quotes(tokens[i + 2].value)) > 0:
+                yield self._issue(rule, tok.line)
+
+    def _sql_injection(self, tokens):
+        from pygments.token import String
+
+        rule = ("SQL Injection", "High",
+                "Possible SQL injection vulnerability detected. Use parameterized queries instead.")
+        for i, tok in enumerate(tokens):
+            if tok.kind != "string" or not _SQL_RE.search(tok.value):
+                continue
+            following = tokens[i + 1].value if i + 1 < len(tokens) else ""
+            preceding = tokens[i - 1].value if i else ""
+            interpolated = (
+                tok.ttype in String.Interpol or "${" in tok.value or "#{" in tok.value
+                or (tok.value.lower().startswith(("f'", 'f"')))
+                or (tok.value.startswith('"') and "$" in tok.value and self.languages[:1] == ("php",))
+            )
+            if interpolated or following in ("+", "%", ".") or preceding in ("+", "."):
+                yield self._issue(rule, tok.line)
+
+    def unit_tests(self, code, language):
+        """
+        Test skeletons for the public functions, or None if unsupported
+        """
+        return None
+
+
+class GenericAnalyzer(LanguageAnalyzer):
+    """
+    Fallback for languages without a dedicated analyzer; relies on the token
+    types Pygments assigns (Name.Function, Name.Class, ...)
+    """
+
+
+GenericAnalyzer.instance = GenericAnalyzer()
+
+
+@register_analyzer
+class PythonAnalyzer(LanguageAnalyzer):
+    languages = ("python", "py", "python3")
+    function_keywords = {"def"}
+    class_keywords = {"class"}
+    import_keywords = {"import", "from"}
+    param_name = "first"
+    block_style = "indent"
+    dangerous_calls = {
+        "eval": ("Code Injection", "High", "Use of eval() detected, which can lead to code injection vulnerabilities."),
+        "exec": ("Code Injection", "High", "Use of exec() detected, which can lead to code injection vulnerabilities."),
+        "os.system": ("Command Injection", "High", "os.system() runs a shell command. Use subprocess with a list of arguments."),
+        "yaml.load": ("Unsafe Deserialization", "Medium", "yaml.load() can construct arbitrary objects. Use yaml.safe_load()."),
+    }
+    dangerous_imports = {
+        "pickle": ("Unsafe Deserialization", "Medium", "Use of pickle module detected. Be cautious with untrusted data."),
+    }
+
+    def imports(self, tokens):
+        from pygments.token import Name
+
+        def dotted(j, line):
+            # Pygments splits "a.b" into Name.Namespace pieces; join them back
+            end = j
+            while end < len(tokens) and tokens[end].ttype in Name.Namespace and tokens[end].line == line:
+                end += 1
+            return "".join(t.value for t in tokens[j:end]), end
+
+        # import a.b, c -> a, c / from a.b import c -> a.b
+        imports = []
+        for i, tok in enumerate(tokens[:-1]):
+            if tok.value in ("import", "from") and tokens[i + 1].ttype in Name.Namespace:
+                if tok.value == "import" and any(
+                        t.value == "from" and t.line == tok.line for t in tokens[max(0, i - 8):i]):
+                    continue
+                module, j = dotted(i + 1, tok.line)
+                if tok.value == "from":
+                    imports.append(module)
+                    continue
+                imports.append(module.split(".")[0])
+                while j + 1 < len(tokens) and tokens[j].value == "," and tokens[j + 1].ttype in Name.Namespace:
+                    module, j = dotted(j + 1, tok.line)
+                    imports.append(module.split(".")[0])
+        return imports
+
+    def unit_tests(self, code, language):
+        tests = []
+        for func_name, params in self.functions(significant_tokens(code, language)):
+            # Skip if it looks like a private method or special method
+            if func_name.startswith('_'):
+                continue
+
+            # Create a basic test for this function
+            clean_params = [p for p in params if p != "self"]
+            test_code = f"""
+def test_{func_name}():
+    # Arrange
+    {"# TODO: Set up test parameters" if clean_params else "pass"}
+    {f"# Parameters: {', '.join(clean_params)}" if clean_params else ""}
+
+    # Act
+    result = {func_name}({", ".join(["None" for _ in clean_params])})
+
+    # Assert
+    assert result is not None  # Replace with actual assertion
+"""
+            tests.append(test_code)
+
+        if tests:
+            return "import pytest\n\n" + "\n".join(tests)
+        return "# No testable functions found in the provided code"
+
+
+@register_analyzer
+class JavaScriptAnalyzer(LanguageAnalyzer):
+    languages = ("javascript", "js", "typescript", "ts", "jsx", "tsx")
+    function_keywords = {"function"}
+    class_keywords = {"class", "interface", "enum"}
+    import_keywords = {"import", "require"}
+    param_name = "first"
+    dangerous_calls = {
+        "eval": ("Code Injection", "High", "Use of eval() detected, which can lead to code injection vulnerabilities."),
+        "Function": ("Code Injection", "High", "new Function() compiles code from strings, like eval()."),
+        "document.write": ("Cross-Site Scripting", "Medium", "document.write() with dynamic content can lead to XSS."),
+        "child_process.exec": ("Command Injection", "High", "child_process.exec() runs a shell command. Use execFile() with arguments."),
+        "execSync": ("Command Injection", "High", "execSync() runs a shell command. Use execFileSync() with arguments."),
+    }
+    dangerous_assignments = {
+        "innerHTML": ("Cross-Site Scripting", "Medium", "Assigning to innerHTML can lead to XSS. Use textContent or sanitize the HTML."),
+        "outerHTML": ("Cross-Site Scripting", "Medium", "Assigning to outerHTML can lead to XSS. Use textContent or sanitize the HTML."),
+    }
+
+    def unit_tests(self, code, language):
+        functions = [(n, p) for n, p in self.functions(significant_tokens(code, language))
+                     if not n.startswith("_") and n != "constructor"]
+        if not functions:
+            return "// No testable functions found in the provided code"
+        tests = [f"""
+test('{name}', () => {{
+  // Arrange
+  {f"// Parameters: {', '.join(params)}" if params else ""}
+
+  // Act
+  const result = {name}({", ".join("undefined" for _ in params)});
+
+  // Assert
+  expect(result).toBeDefined(); // Replace with actual assertion
+}});
+""" for name, params in functions]
+        names = ", ".join(name for name, _ in functions)
+        return f"const {{ {names} }} = require('./module'); // Adjust the import path\n" + "\n".join(tests)
+
+
+@register_analyzer
+class JavaAnalyzer(LanguageAnalyzer):
+    languages = ("java",)
+    class_keywords = {"class", "interface", "enum", "record"}
+    import_keywords = {"import"}
+    dangerous_calls = {
+        "exec": ("Command Injection", "Medium", "exec() call detected; make sure no user input reaches the command."),
+        "createStatement": ("SQL Injection", "Medium", "Statement objects run raw SQL. Prefer PreparedStatement with parameters."),
+    }
+    dangerous_imports = {
+        "java.io.ObjectInputStream": ("Unsafe Deserialization", "Medium", "ObjectInputStream deserializes arbitrary objects. Be cautious with untrusted data."),
+    }
+
+    def unit_tests(self, code, language):
+        functions = [(n, p) for n, p in self.functions(significant_tokens(code, language)) if n != "main"]
+        if not functions:
+            return "// No testable methods found in the provided code"
+        tests = [f"""
+    @Test
+    void test{name[:1].upper() + name[1:]}() {{
+        // Arrange
+        {f"// Parameters: {', '.join(params)}" if params else ""}
+
+        // Act
+        // var result = subject.{name}({", ".join("null" for _ in params)});
+
+        // Assert
+        // assertNotNull(result); // Replace with actual assertion
+    }}
+""" for name, params in functions]
+        return "import org.junit.jupiter.api.Test;\nimport static org.junit.jupiter.api.Assertions.*;\n\n" \
+               "class GeneratedTest {\n" + "".join(tests) + "}\n"
+
+
+@register_analyzer
+class CSharpAnalyzer(LanguageAnalyzer):
+    languages = ("csharp", "c#", "cs")
+    class_keywords = {"class", "struct", "interface", "enum", "record"}
+    import_keywords = {"using"}
+    dangerous_calls = {
+        "Process.Start": ("Command Injection", "High", "Process.Start() runs an external program. Validate its arguments."),
+        "SqlCommand": ("SQL Injection", "Medium", "SqlCommand with concatenated text is injectable. Use SqlParameter."),
+        "BinaryFormatter.Deserialize": ("Unsafe Deserialization", "High", "BinaryFormatter is unsafe for untrusted data."),
+    }
+
+    def imports(self, tokens):
+        from pygments.token import Name
+
+        # `using` directives name a namespace; using statements do not
+        return [tokens[i + 1].value for i, tok in enumerate(tokens[:-1])
+                if tok.value == "using" and tokens[i + 1].ttype in Name.Namespace]
+
+
+@register_analyzer
+class CAnalyzer(LanguageAnalyzer):
+    languages = ("c", "cpp", "c++", "objective-c")
+    class_keywords = {"class", "struct", "union", "enum"}
+    import_keywords = set()
+    dangerous_calls = {
+        name: ("Buffer Overflow", "High", f"{name}() does not check buffer sizes. Use a bounded alternative.")
+        for name in ("strcpy", "strcat", "sprintf", "gets", "vsprintf")
+    }
+    dangerous_calls.update({
+        "system": ("Command Injection", "High", "system() runs a shell command. Avoid passing user input to it."),
+        "popen": ("Command Injection", "High", "popen() runs a shell command. Avoid passing user input to it."),
+    })
+
+
+@register_analyzer
+class GoAnalyzer(LanguageAnalyzer):
+    languages = ("go", "golang")
+    function_keywords = {"func"}
+    class_keywords = {"type"}
+    import_keywords = {"import"}
+    param_name = "first"
+    dangerous_calls = {
+        "exec.Command": ("Command Injection", "Medium", "exec.Command() runs an external program. Validate its arguments."),
+        "template.HTML": ("Cross-Site Scripting", "Medium", "template.HTML disables escaping. Only use it on trusted content."),
+    }
+
+    def functions(self, tokens):
+        # func (r *Recv) Name(...): the receiver comes before the name
+        found = super().functions(tokens)
+        names = {name for name, _ in found}
+        for i, tok in enumerate(tokens[:-1]):
+            if tok.value == "func" and tokens[i + 1].value == "(":
+                end = _matching(tokens, i + 1)
+                if end is not None and end + 2 < len(tokens) and tokens[end + 1].kind == "name" \
+                        and tokens[end + 2].value == "(" and tokens[end + 1].value not in names:
+                    found.append((tokens[end + 1].value, self._params(tokens, end + 2)))
+        return found
+
+    def unit_tests(self, code, language):
+        functions = [n for n, _ in self.functions(significant_tokens(code, language)) if n[:1].isupper()]
+        if not functions:
+            return "// No exported functions found in the provided code"
+        tests = [f"""
+func Test{name}(t *testing.T) {{
+	// Arrange
+	// Act
+	// result := {name}(...)
+	// Assert
+	t.Skip("TODO: replace with actual assertions")
+}}
+""" for name in functions]
+        return 'import "testing"\n' + "".join(tests)
+
+
+@register_analyzer
+class RustAnalyzer(LanguageAnalyzer):
+    languages = ("rust", "rs")
+    function_keywords = {"fn"}
+    class_keywords = {"struct", "enum", "trait"}
+    import_keywords = {"use"}
+    param_name = "first"
+    dangerous_calls = {
+        "Command.new": ("Command Injection", "Medium", "Command::new() runs an external program. Validate its arguments."),
+    }
+
+
+@register_analyzer
+class PhpAnalyzer(LanguageAnalyzer):
+    languages = ("php",)
+    import_keywords = {"use", "require", "require_once", "include", "include_once"}
+    dangerous_calls = {
+        name: ("Command Injection", "High", f"{name}() runs a shell command. Escape arguments with escapeshellarg().")
+        for name in ("exec", "shell_exec", "system", "passthru", "popen")
+    }
+    dangerous_calls.update({
+        "eval": ("Code Injection", "High", "Use of eval() detected, which can lead to code injection vulnerabilities."),
+        "unserialize": ("Unsafe Deserialization", "Medium", "unserialize() on untrusted data can instantiate objects. Use json_decode()."),
+        "mysql_query": ("SQL Injection", "High", "mysql_query() is deprecated and injectable. Use PDO prepared statements."),
+    })
+
+
+@register_analyzer
+class RubyAnalyzer(LanguageAnalyzer):
+    languages = ("ruby", "rb")
+    function_keywords = {"def"}
+    class_keywords = {"class", "module"}
+    import_keywords = {"require", "require_relative"}
+    param_name = "first"
+    block_style = "indent"
+    indent_unit = 2
+    dangerous_calls = {
+        "eval": ("Code Injection", "High", "Use of eval() detected, which can lead to code injection vulnerabilities."),
+        "system": ("Command Injection", "High", "system() runs a shell command. Pass arguments separately."),
+        "Marshal.load": ("Unsafe Deserialization", "Medium", "Marshal.load on untrusted data is unsafe."),
+    }
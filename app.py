@@ -1,14 +1,18 @@
-from fastapi import FastAPI, HTTPException, Form, File, UploadFile, BackgroundTasks
+# Imported first so the start-up time covers the rest of the app
+from startup import ensure_runtime_dirs, lazy_import, mark, on_ready, startup_timings
+from fastapi import FastAPI, HTTPException, Form, File, UploadFile, BackgroundTasks, Depends, Header
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from fastapi.responses import FileResponse, StreamingResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-import requests
+from fastapi.concurrency import run_in_threadpool
 import os
 import json
 import uuid
+import asyncio
 from typing import Optional, List, Dict, Any
 from pydantic import BaseModel
 import shutil
+import threading
 from datetime import datetime
 
 # Import utility functions
@@ -17,23 +21,59 @@ from utils import (
     generate_unit_tests, 
     check_security_issues,
     format_code_with_highlighting,
+    normalize_highlight_language,
+    get_highlight_css,
     break_down_task,
     generate_unique_id,
     store_shared_code,
     get_shared_code,
     save_user_template,
     analyze_project_structure,
+    encode_structure_table,
     analyze_dependencies,
     create_zip_archive,
     generate_multiple_files
 )
+from profiling import (
+    ProfilingMiddleware,
+    profiled,
+    get_profile_path,
+    list_profiles
+)
+from metrics import MetricsMiddleware, get_metrics
+from compression import CompressionMiddleware
+from ratelimit import RateLimitMiddleware, current_client
+from fast_json import JSONResponse
+from llm import (
+    OllamaError,
+    GenerationCancelled,
+    build_prompt,
+    cancel_on_disconnect
+)
+import metrics
+from sessions import sessions, StaleSession
+from prefetch import prefetcher
+from retrieval import snippet_index
+from live_highlight import live_documents, DocumentOutOfSync
+from routing import choose_route, session_route, generate_routed
+from jobs import job_queue, JOB_POLL_INTERVAL, TERMINAL_STATUSES
+from postprocess import CodeBlockExtractor, extract_code_blocks
+from model_manager import model_manager
+
+# Only needed for its exception types, when a generation fails
+requests = lazy_import("requests")
 
 app = FastAPI(
     title="AI Code Companion API",
     description="API for the AI Code Companion application",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=JSONResponse
 )
 
+# Per-client request and LLM token budgets; added before CORS so that
+# rejected requests still get the CORS headers
+app.add_middleware(RateLimitMiddleware)
+
 # Enable CORS
 app.add_middleware(
     CORSMiddleware,
@@ -43,15 +83,23 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Opt-in per-request profiling (X-Profile header or PROFILE_SAMPLE_RATE)
+app.add_middleware(ProfilingMiddleware)
+
+# Request counters, shared by all workers
+app.add_middleware(MetricsMiddleware)
+
+# gzip/brotli for large text and JSON responses, negotiated via Accept-Encoding
+app.add_middleware(CompressionMiddleware)
+
+# Directories served below must exist before they are mounted
+ensure_runtime_dirs()
+
 # Serve static files (HTML, CSS, JS)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 app.mount("/shared_code", StaticFiles(directory="shared_code"), name="shared_code")
 app.mount("/generated", StaticFiles(directory="generated"), name="generated")
 
-OLLAMA_URL = "http://localhost:11434/api/generate"
-MODEL_NAME = "codellama:7b-instruct"
-  # Using CodeLlama for code generation & debugging
-
 # Directory containing prompt templates
 PROMPTS_DIR = os.path.join(os.path.dirname(__file__), "prompts")
 
@@ -94,6 +142,7 @@ def get_prompt_content(prompt_file: str):
         raise HTTPException(status_code=500, detail=f"Error reading prompt file: {str(e)}")
 
 @app.post("/generate_code")
+@profiled
 def generate_code(
     code: Optional[str] = Form(None),
     prompt: Optional[str] = Form(None), 
@@ -101,13 +150,22 @@ def generate_code(
     language: str = Form(...),
     task_description: Optional[str] = Form(None),
     project_spec: Optional[str] = Form(None),
-    prompt_template: Optional[str] = Form(None)
+    prompt_template: Optional[str] = Form(None),
+    session_id: Optional[str] = Form(None),
+    no_cache: bool = Form(False),
+    cache_control: Optional[str] = Header(None),
+    cancel_event: threading.Event = Depends(cancel_on_disconnect)
 ):
     """
-    Generate, debug, or explain code based on the selected mode
+    Generate, debug, or explain code based on the selected mode.
+    With a session_id the request continues that conversation, so follow-up
+    turns can omit the code and Ollama reuses the already-encoded context.
+    If the client disconnects, the generation is aborted upstream.
+    A repeat of an earlier request is answered with the earlier reply unless
+    no_cache is set or the request has Cache-Control: no-cache.
+    `blocks` lists the reply's fenced code blocks, syntax-checked and
+    highlighted (styles from /highlight_code/css).
     """
-    headers = {"Content-Type": "application/json"}
-    
     # Determine which input to use based on mode
     input_text = prompt or code or task_description or project_spec or ""
     
@@ -115,25 +173,30 @@ def generate_code(
     print(f"Mode: {mode}, Language: {language}")
     print(f"Input text length: {len(input_text)}")
     
-    # Define prompts based on mode (generate, debug, or explain)
-    if mode == "generate":
-        full_prompt = f"Write a clean, well-documented {language} code for: {input_text}"
-    elif mode == "debug":
-        full_prompt = f"Debug and fix the following {language} code:\n{input_text}"
-    elif mode == "explain":
-        full_prompt = f"""Explain the following {language} code in detail:
-```
-{input_text}
-```
-
-Please include:
-1. What the code does overall
-2. How it works step by step
-3. Explanation of any complex or non-obvious parts
-4. Any potential issues or improvements
-
-Format your explanation in clear, concise language that would help a beginner understand the code."""
-    else:
+    session = None
+    if session_id:
+        session = sessions.get(session_id)
+        if session is None:
+            return JSONResponse(
+                content={"code": f"Session not found or expired: {session_id}"},
+                status_code=404
+            )
+    
+    examples = None
+    if mode == "generate" and input_text.strip():
+        # Few-shot examples from the team's shared snippets and indexed projects
+        examples = snippet_index.examples(input_text, language)
+    
+    # Model and generation options for this mode and input size
+    route = session_route(mode, input_text) if session else choose_route(mode, input_text)
+    
+    full_prompt = build_prompt(
+        mode, language, input_text,
+        follow_up=bool(session and session.turns),
+        examples=examples,
+        brief=route.brief
+    )
+    if full_prompt is None:
         # Return error response instead of raising exception
         return JSONResponse(
             content={"code": f"Invalid mode selected: {mode}"},
@@ -141,29 +204,62 @@ Format your explanation in clear, concise language that would help a beginner un
         )
 
     try:
-        # Send the request to Ollama without streaming (to avoid potential streaming issues)
-        response = requests.post(
-            OLLAMA_URL,
-            json={"model": MODEL_NAME, "prompt": full_prompt, "stream": False},
-            headers=headers
-        )
+        if no_cache or "no-cache" in (cache_control or "").lower():
+            metrics.incr("retrieval.duplicate_bypassed")
+        elif session is None:
+            # Repeated requests are answered straight from the retrieval index
+            duplicate = snippet_index.find_duplicate(mode, language, input_text)
+            if duplicate is not None:
+                metrics.incr("retrieval.duplicate_hit")
+                return {"code": duplicate, "blocks": extract_code_blocks(duplicate, language)}
         
-        # Check if the request was successful
-        if response.status_code != 200:
-            print(f"Ollama API error: {response.status_code} - {response.text}")
-            return JSONResponse(
-                content={"code": f"Ollama API returned error: {response.text}"},
-                status_code=200  # Return 200 to client but with error message
+        if session is None and mode == "explain":
+            # Hand over a speculative explanation started when the code was pasted
+            prefetched = prefetcher.take(language, input_text, cancel_event)
+            if prefetched is not None:
+                return {"code": prefetched, "blocks": extract_code_blocks(prefetched, language)}
+        
+        # Code blocks are checked and highlighted while the reply streams in
+        extractor = CodeBlockExtractor(language)
+        if session is None:
+            json_response, route = generate_routed(
+                route, full_prompt, cancel_event=cancel_event, on_text=extractor.feed
             )
+            snippet_index.add_generation(mode, language, input_text, json_response["response"])
+            return {"code": json_response["response"], "blocks": extractor.close()}
         
-        # Process the non-streaming response
-        json_response = response.json()
-        if "response" in json_response:
-            return {"code": json_response["response"]}
-        else:
-            print("Unexpected response format:", json_response)
-            return {"code": "No valid response received from Ollama."}
+        json_response, route = generate_routed(
+            route,
+            full_prompt,
+            context=session.context,
+            cancel_event=cancel_event,
+            on_text=extractor.feed
+        )
+        session.add_turn(mode, input_text, json_response["response"], json_response.get("context"))
+        sessions.save(session)
+        return {
+            "code": json_response["response"],
+            "blocks": extractor.close(),
+            "session_id": session.id,
+            "turn": len(session.turns)
+        }
 
+    except StaleSession:
+        # Another request (possibly on another worker) added a turn meanwhile
+        return JSONResponse(
+            content={"code": "This session was updated by another request. Reload it and try again."},
+            status_code=409
+        )
+    except GenerationCancelled:
+        # Nobody is waiting for this response any more
+        print(f"Generation cancelled: client disconnected ({mode})")
+        metrics.incr("generate_code.cancelled")
+        return JSONResponse(content={"code": "Request cancelled"}, status_code=499)
+    except OllamaError as e:
+        return JSONResponse(
+            content={"code": str(e)},
+            status_code=200  # Return 200 to client but with error message
+        )
     except requests.exceptions.RequestException as e:
         # Handle request exceptions
         print(f"Request to Ollama failed: {str(e)}")
@@ -179,9 +275,65 @@ Format your explanation in clear, concise language that would help a beginner un
             status_code=200  # Return 200 to client but with error message
         )
 
+@app.post("/prefetch")
+def prefetch_endpoint(
+    code: str = Form(...),
+    language: str = Form("python"),
+    client_id: str = Form(...)
+):
+    """
+    Speculatively start explaining pasted code and warm the analysis caches.
+    Prefetch work is cancelled when the client edits the code, goes idle,
+    or when real requests need the model.
+    """
+    try:
+        if not code.strip():
+            raise ValueError("Code cannot be empty")
+        status = prefetcher.start(client_id, language, code)
+        return JSONResponse(content={"status": status})
+    except Exception as e:
+        print(f"Error prefetching: {str(e)}")
+        return JSONResponse(content={"status": "error", "message": f"Error prefetching: {str(e)}"})
+
+@app.delete("/prefetch/{client_id}")
+def cancel_prefetch(client_id: str):
+    """
+    Cancel a client's pending prefetch, e.g. after the code was edited
+    """
+    return JSONResponse(content={"cancelled": prefetcher.cancel(client_id)})
+
+@app.post("/sessions")
+def create_session(
+    language: str = Form("python")
+):
+    """
+    Start a conversation session for iterative generate/debug/explain turns
+    """
+    session = sessions.create(language)
+    return JSONResponse(content={"session_id": session.id})
+
+@app.get("/sessions/{session_id}")
+def get_session(session_id: str):
+    """
+    Retrieve the turns of a conversation session
+    """
+    session = sessions.get(session_id)
+    if session is None:
+        return JSONResponse(content={"error": "Session not found or expired"}, status_code=404)
+    return JSONResponse(content=session.to_dict())
+
+@app.delete("/sessions/{session_id}")
+def delete_session(session_id: str):
+    """
+    End a conversation session and free its context
+    """
+    sessions.delete(session_id)
+    return JSONResponse(content={"status": "deleted"})
+
 # New endpoints for advanced features
 
 @app.post("/analyze_code")
+@profiled
 def analyze_code_endpoint(
     code: str = Form(...),
     language: str = Form("python")
@@ -204,6 +356,7 @@ def analyze_code_endpoint(
         )
 
 @app.post("/generate_tests")
+@profiled
 def generate_tests_endpoint(
     code: str = Form(...),
     language: str = Form("python")
@@ -226,6 +379,7 @@ def generate_tests_endpoint(
         )
 
 @app.post("/security_scan")
+@profiled
 def security_scan_endpoint(
     code: str = Form(...),
     language: str = Form("python")
@@ -248,34 +402,22 @@ def security_scan_endpoint(
         )
 
 @app.post("/highlight_code")
+@profiled
 def highlight_code_endpoint(
     code: str = Form(...),
-    language: str = Form("python")
+    language: str = Form("python"),
+    include_css: bool = Form(True)
 ):
     """
-    Format code with syntax highlighting
+    Format code with syntax highlighting. Clients that already loaded
+    /highlight_code/css can pass include_css=false to skip it.
     """
     try:
         # Validate input
         if not code or len(code.strip()) == 0:
             raise ValueError("Code cannot be empty")
             
-        # Clean up language string to ensure compatibility with Pygments
-        language = language.lower().strip()
-        
-        # Map common language names to Pygments lexer names
-        language_map = {
-            "js": "javascript",
-            "py": "python",
-            "cs": "csharp",
-            "ts": "typescript",
-            "c++": "cpp",
-            "html+css": "html",
-            "html+js": "html"
-        }
-        
-        if language in language_map:
-            language = language_map[language]
+        language = normalize_highlight_language(language)
             
         # Format the code with syntax highlighting
         highlighted = format_code_with_highlighting(code, language)
@@ -283,6 +425,8 @@ def highlight_code_endpoint(
         # For debugging
         print(f"Highlighting result: {highlighted}")
         
+        if not include_css:
+            highlighted = {"html": highlighted["html"]}
         return JSONResponse(content=highlighted)
     except Exception as e:
         print(f"Highlighting error: {str(e)}")
@@ -292,6 +436,79 @@ def highlight_code_endpoint(
             "css": ""
         })
 
+@app.get("/highlight_code/css")
+def highlight_css():
+    """
+    Stylesheet for highlighted code; the same for every response, so cacheable
+    """
+    return PlainTextResponse(
+        get_highlight_css(),
+        media_type="text/css",
+        headers={"Cache-Control": "public, max-age=86400"}
+    )
+
+@app.post("/highlight_code/live")
+@profiled
+def open_live_document(
+    code: str = Form(""),
+    language: str = Form("python"),
+    doc_id: Optional[str] = Form(None)
+):
+    """
+    Start (or restart) incremental highlighting of an editor buffer.
+    Returns every line; later edits only return the lines that changed.
+    """
+    try:
+        document = live_documents.open(doc_id or uuid.uuid4().hex, normalize_highlight_language(language), code)
+        return JSONResponse(content={
+            "doc_id": document.id,
+            "hash": document.hash,
+            "lines": document.html,
+            "css": get_highlight_css()
+        })
+    except Exception as e:
+        print(f"Error opening live document: {str(e)}")
+        return JSONResponse(content={"error": f"Error opening live document: {str(e)}"}, status_code=200)
+
+@app.post("/highlight_code/live/{doc_id}")
+@profiled
+def edit_live_document(
+    doc_id: str,
+    base_hash: str = Form(...),
+    start_line: int = Form(...),
+    end_line: int = Form(...),
+    text: str = Form("")
+):
+    """
+    Replace lines [start_line, end_line) of a live document with `text`.
+    The patch says which HTML lines to replace: `delete` lines from `start`
+    are replaced by `lines`.
+    """
+    try:
+        document, (first, deleted, lines) = live_documents.edit(doc_id, base_hash, start_line, end_line, text)
+        metrics.incr("highlight.live_lines", len(lines))
+        return JSONResponse(content={
+            "doc_id": doc_id,
+            "hash": document.hash,
+            "line_count": len(document.lines),
+            "patch": {"start": first, "delete": deleted, "lines": lines}
+        })
+    except DocumentOutOfSync:
+        # Unknown to this worker, or the client missed an update: send the whole buffer again
+        metrics.incr("highlight.live_resync")
+        return JSONResponse(content={"error": "Document out of sync", "resync": True}, status_code=409)
+    except Exception as e:
+        print(f"Error updating live document: {str(e)}")
+        return JSONResponse(content={"error": f"Error updating live document: {str(e)}", "resync": True}, status_code=200)
+
+@app.delete("/highlight_code/live/{doc_id}")
+def close_live_document(doc_id: str):
+    """
+    Drop the server-side state of a live document
+    """
+    live_documents.close(doc_id)
+    return JSONResponse(content={"closed": True})
+
 @app.post("/plan_implementation")
 def plan_implementation_endpoint(
     task_description: str = Form(...)
@@ -313,6 +530,7 @@ def plan_implementation_endpoint(
         )
 
 @app.post("/share_code")
+@profiled
 def share_code(
     code: str = Form(...),
     language: str = Form("python")
@@ -331,6 +549,9 @@ def share_code(
         # Store the code with the ID
         store_shared_code(code_id, code, language)
         
+        # Shared snippets become few-shot examples for future generations
+        snippet_index.add_snippet(code, language)
+        
         # For debugging
         print(f"Code shared with ID: {code_id}")
         
@@ -379,6 +600,7 @@ def save_prompt_template(
             
         # Save the template
         template_path = save_user_template(template_name, template_content)
+        snippet_index.add_snippet(template_content, "", source="template")
         
         return JSONResponse(content={
             "status": "success",
@@ -395,23 +617,39 @@ def save_prompt_template(
             status_code=200  # Return 200 to client but with error message
         )
 
+def analyze_project_result(project_path, structure_format="paths", job=None):
+    """
+    Structure and dependencies of a project, for the endpoint and for jobs
+    """
+    if job:
+        job.progress(0.1, "Scanning files")
+    structure = analyze_project_structure(project_path)
+    if structure_format == "table":
+        structure = encode_structure_table(structure)
+    if job:
+        job.progress(0.6, "Reading dependencies")
+    dependencies = analyze_dependencies(project_path)
+    return {
+        "structure": structure,
+        "dependencies": dependencies
+    }
+
 @app.post("/analyze_project")
+@profiled
 def analyze_project_endpoint(
-    project_path: str = Form(...)
+    project_path: str = Form(...),
+    structure_format: str = Form("paths")
 ):
     """
-    Analyze the structure of a project directory
+    Analyze the structure of a project directory.
+    `structure_format=table` returns the compact directory-table encoding
+    instead of full relative paths.
     """
     try:
         # Print debug information
         print(f"Analyzing project at path: {project_path}")
         
-        structure = analyze_project_structure(project_path)
-        dependencies = analyze_dependencies(project_path)
-        return JSONResponse(content={
-            "structure": structure,
-            "dependencies": dependencies
-        })
+        return JSONResponse(content=analyze_project_result(project_path, structure_format))
     except Exception as e:
         print(f"Error analyzing project: {str(e)}")
         return JSONResponse(
@@ -422,7 +660,66 @@ def analyze_project_endpoint(
             status_code=200  # Return 200 to client but with error message
         )
 
+@app.post("/retrieval/index_project")
+def index_project_endpoint(
+    project_path: str = Form(...)
+):
+    """
+    Add a project's source files to the snippet retrieval index. Only
+    projects under RETRIEVAL_PROJECT_ROOT can be indexed; relative paths
+    are taken from there.
+    """
+    try:
+        chunks = snippet_index.index_project(project_path)
+        return JSONResponse(content={"indexed_chunks": chunks, **snippet_index.stats()})
+    except PermissionError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=403)
+    except ValueError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=400)
+    except Exception as e:
+        print(f"Error indexing project: {str(e)}")
+        return JSONResponse(content={"error": f"Error indexing project: {str(e)}"})
+
+@app.post("/retrieval/search")
+def retrieval_search_endpoint(
+    query: str = Form(...),
+    language: Optional[str] = Form(None),
+    k: int = Form(5)
+):
+    """
+    Find the shared or project snippets most relevant to a query
+    """
+    try:
+        return JSONResponse(content={"results": snippet_index.search(query, language, k)})
+    except Exception as e:
+        print(f"Error searching snippets: {str(e)}")
+        return JSONResponse(content={"results": [], "error": f"Error searching snippets: {str(e)}"})
+
+def generate_project_result(project_spec, job=None):
+    """
+    Generate a project's files and zip them, for the endpoint and for jobs
+    """
+    if job:
+        job.progress(0.1, "Generating files")
+    files = generate_multiple_files(project_spec)
+    if job:
+        job.progress(0.7, "Creating archive")
+    zip_path = create_zip_archive(files)
+    if job:
+        # The archive is removed together with the expired job
+        job.add_artifact(zip_path)
+    
+    # Get the filename from the path
+    filename = os.path.basename(zip_path)
+    
+    # Return a download link
+    return {
+        "download_url": f"/generated/{filename}",
+        "files": list(files.keys())
+    }
+
 @app.post("/generate_project")
+@profiled
 def generate_project_endpoint(
     project_spec: str = Form(...)
 ):
@@ -433,17 +730,7 @@ def generate_project_endpoint(
         # Print debug information
         print(f"Generating project from spec: {project_spec[:100]}...")
         
-        files = generate_multiple_files(project_spec)
-        zip_path = create_zip_archive(files)
-        
-        # Get the filename from the path
-        filename = os.path.basename(zip_path)
-        
-        # Return a download link
-        return JSONResponse(content={
-            "download_url": f"/generated/{filename}",
-            "files": list(files.keys())
-        })
+        return JSONResponse(content=generate_project_result(project_spec))
     except Exception as e:
         print(f"Error generating project: {str(e)}")
         return JSONResponse(
@@ -454,6 +741,102 @@ def generate_project_endpoint(
             status_code=200  # Return 200 to client but with error message
         )
 
+@job_queue.handler("generate_project")
+def run_generate_project_job(job, project_spec):
+    return generate_project_result(project_spec, job)
+
+@job_queue.handler("analyze_project")
+def run_analyze_project_job(job, project_path, structure_format="paths"):
+    return analyze_project_result(project_path, structure_format, job)
+
+def submit_job(kind, params, background_tasks):
+    job_id = job_queue.submit(kind, params, client=current_client())
+    # Nudge this process's workers once the response is sent
+    background_tasks.add_task(job_queue.wake)
+    return JSONResponse(
+        content={
+            "job_id": job_id,
+            "status": "queued",
+            "status_url": f"/jobs/{job_id}",
+            "events_url": f"/jobs/{job_id}/events",
+            "result_url": f"/jobs/{job_id}/result"
+        },
+        status_code=202
+    )
+
+@app.post("/jobs/generate_project")
+def submit_generate_project_job(
+    background_tasks: BackgroundTasks,
+    project_spec: str = Form(...)
+):
+    """
+    Queue /generate_project as a background job
+    """
+    return submit_job("generate_project", {"project_spec": project_spec}, background_tasks)
+
+@app.post("/jobs/analyze_project")
+def submit_analyze_project_job(
+    background_tasks: BackgroundTasks,
+    project_path: str = Form(...),
+    structure_format: str = Form("paths")
+):
+    """
+    Queue /analyze_project as a background job
+    """
+    params = {"project_path": project_path, "structure_format": structure_format}
+    return submit_job("analyze_project", params, background_tasks)
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    """
+    Status and progress of a job
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        return JSONResponse(content={"error": "Job not found"}, status_code=404)
+    return JSONResponse(content=job)
+
+@app.get("/jobs/{job_id}/result")
+def get_job_result(job_id: str):
+    """
+    Result of a finished job; 202 while it is still queued or running
+    """
+    job = job_queue.get(job_id, include_result=True)
+    if job is None:
+        return JSONResponse(content={"error": "Job not found"}, status_code=404)
+    if job["status"] not in TERMINAL_STATUSES:
+        return JSONResponse(content=job, status_code=202)
+    return JSONResponse(content=job)
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str):
+    """
+    Server-sent events with the job's status and progress until it finishes
+    """
+    async def events():
+        last_update = None
+        while True:
+            # SQLite read in a worker thread, off the event loop
+            job = await run_in_threadpool(job_queue.get, job_id)
+            if job is None:
+                yield f"event: error\ndata: {json.dumps({'error': 'Job not found'})}\n\n"
+                return
+            if job["updated_at"] != last_update:
+                last_update = job["updated_at"]
+                yield f"data: {json.dumps(job)}\n\n"
+            if job["status"] in TERMINAL_STATUSES:
+                return
+            await asyncio.sleep(JOB_POLL_INTERVAL / 2)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.delete("/jobs/{job_id}")
+def cancel_job(job_id: str):
+    """
+    Cancel a queued job, or ask a running one to stop
+    """
+    return JSONResponse(content={"cancelled": job_queue.cancel(job_id)})
+
 @app.get("/download/{filename}")
 def download_file(filename: str):
     """
@@ -469,7 +852,76 @@ def download_file(filename: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error downloading file: {str(e)}")
 
+@app.get("/metrics")
+def metrics_endpoint():
+    """
+    Counters aggregated across all worker processes
+    """
+    return JSONResponse(content={**get_metrics(), "startup": startup_timings()})
+
+@app.get("/models")
+def models_endpoint():
+    """
+    Models loaded on the Ollama server, with per-model traffic and load counts
+    """
+    return JSONResponse(content=model_manager.status())
+
+@app.get("/profiles")
+def get_profiles():
+    """
+    List saved request profiles
+    """
+    return JSONResponse(content={"profiles": list_profiles()})
+
+@app.get("/profiles/{filename}")
+def download_profile(filename: str):
+    """
+    Download a saved profile (.prof for pstats/snakeviz, .folded for flamegraphs)
+    """
+    file_path = get_profile_path(filename)
+    if not file_path:
+        raise HTTPException(status_code=404, detail=f"Profile not found: {filename}")
+    return FileResponse(file_path, filename=filename)
+
+@app.on_event("startup")
+def report_startup():
+    """
+    Log the start-up time and warm caches once the app is ready to serve
+    """
+    on_ready()
+    # Resume jobs left queued (or interrupted) by a previous run
+    job_queue.start()
+    # Load the configured models now rather than on the first request
+    model_manager.start()
+
+mark("imported")
+
 # Run the API server
 if __name__ == "__main__":
+    import argparse
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
+
+    parser = argparse.ArgumentParser(description="Run the AI Code Companion API")
+    parser.add_argument("--host", default=os.environ.get("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", str(os.cpu_count() or 1))),
+                        help="Number of worker processes in production mode")
+    parser.add_argument("--graceful-timeout", type=int, default=30,
+                        help="Seconds to let in-flight requests finish on shutdown")
+    parser.add_argument("--dev", action="store_true",
+                        help="Single process with auto-reload, for local development")
+    args = parser.parse_args()
+
+    if args.dev:
+        uvicorn.run("app:app", host=args.host, port=args.port, reload=True)
+    else:
+        # Workers share caches and counters through the SQLite store, so no
+        # per-process warm-up is lost when adding workers
+        uvicorn.run(
+            "app:app",
+            host=args.host,
+            port=args.port,
+            workers=args.workers,
+            timeout_graceful_shutdown=args.graceful_timeout,
+            proxy_headers=True
+        )
@@ -0,0 +1,124 @@
+"""
+Benchmark model routing policies against the configured Ollama server.
+
+Runs the same set of requests (short and long inputs for each mode) under
+every policy and reports latency and tokens used, overall and per route:
+
+    python benchmark_routing.py --policies default adaptive --repeat 3
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+import llm
+from routing import POLICIES, choose_route, generate_routed
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _source_excerpt(lines):
+    with open(os.path.join(_HERE, "utils.py"), encoding="utf-8") as f:
+        return "".join(f.readlines()[:lines])
+
+
+def benchmark_cases():
+    """
+    (name, mode, language, input) for each benchmarked request
+    """
+    long_code = _source_excerpt(80)
+    return [
+        ("debug-short", "debug", "python", "def average(xs):\n    return sum(xs) / len(xs) + 1\n"),
+        ("debug-long", "debug", "python", long_code + "\n    return issues +\n"),
+        ("explain-short", "explain", "python", "squares = [x * x for x in range(10) if x % 2]\n"),
+        ("explain-long", "explain", "python", long_code),
+        ("generate-short", "generate", "python", "a function that checks whether a string is a palindrome"),
+        ("generate-long", "generate", "python",
+         "a command-line tool that " + ", then ".join(
+             ["reads a CSV file", "validates every row against a schema", "groups rows by customer",
+              "computes monthly totals", "writes a JSON report", "and logs any rejected rows"] * 60)),
+    ]
+
+
+def run_policy(policy, cases, repeat):
+    results = []
+    for name, mode, language, input_text in cases:
+        route = choose_route(mode, input_text, policy)
+        prompt = llm.build_prompt(mode, language, input_text, brief=route.brief)
+        for _ in range(repeat):
+            started = time.perf_counter()
+            try:
+                reply, used = generate_routed(route, prompt)
+            except Exception as e:
+                results.append({"case": name, "route": route.name, "error": str(e)})
+                continue
+            results.append({
+                "case": name,
+                "route": used.name,
+                "model": used.model,
+                "seconds": time.perf_counter() - started,
+                "prompt_tokens": reply.get("prompt_eval_count", 0),
+                "eval_tokens": reply.get("eval_count", 0),
+                "eval_seconds": reply.get("eval_duration", 0) / 1e9
+            })
+    return results
+
+
+def summarize(results):
+    ok = [r for r in results if "error" not in r]
+    latencies = sorted(r["seconds"] for r in ok)
+    eval_seconds = sum(r["eval_seconds"] for r in ok)
+    return {
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "mean_s": round(statistics.mean(latencies), 3) if latencies else None,
+        "p50_s": round(latencies[len(latencies) // 2], 3) if latencies else None,
+        "p95_s": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3) if latencies else None,
+        "prompt_tokens": sum(r["prompt_tokens"] for r in ok),
+        "eval_tokens": sum(r["eval_tokens"] for r in ok),
+        "tokens_per_s": round(sum(r["eval_tokens"] for r in ok) / eval_seconds, 1) if eval_seconds else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark model routing policies")
+    parser.add_argument("--policies", nargs="+", default=sorted(POLICIES), choices=sorted(POLICIES))
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each request per policy")
+    parser.add_argument("--json", action="store_true", help="print the raw results as JSON")
+    args = parser.parse_args()
+
+    cases = benchmark_cases()
+    report = {}
+    for policy in args.policies:
+        print(f"Running policy '{policy}' against {llm.OLLAMA_URL}...", file=sys.stderr)
+        results = run_policy(policy, cases, args.repeat)
+        by_route = {}
+        for result in results:
+            by_route.setdefault(result["route"], []).append(result)
+        report[policy] = {
+            "total": summarize(results),
+            "routes": {route: summarize(items) for route, items in sorted(by_route.items())},
+            "results": results
+        }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    header = f"{'policy':<10} {'route':<16} {'req':>4} {'err':>4} {'mean s':>8} {'p50 s':>8} {'p95 s':>8} " \
+             f"{'prompt tok':>11} {'eval tok':>9} {'tok/s':>7}"
+    print(header)
+    print("-" * len(header))
+    for policy, data in report.items():
+        for route, summary in list(data["routes"].items()) + [("(all)", data["total"])]:
+            print(
+                f"{policy:<10} {route:<16} {summary['requests']:>4} {summary['errors']:>4} "
+                f"{summary['mean_s'] or '-':>8} {summary['p50_s'] or '-':>8} {summary['p95_s'] or '-':>8} "
+                f"{summary['prompt_tokens']:>11} {summary['eval_tokens']:>9} {summary['tokens_per_s'] or '-':>7}"
+            )
+
+
+if __name__ == "__main__":
+    main()
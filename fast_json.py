@@ -0,0 +1,37 @@
+import json
+
+from starlette.responses import JSONResponse as StarletteJSONResponse
+
+# orjson is optional; it serializes large responses several times faster
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(content):
+    """
+    Serialize to compact UTF-8 JSON bytes, with orjson when it is installed
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # e.g. integers wider than 64 bits; the standard library handles those
+            pass
+    return json.dumps(
+        content,
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+class JSONResponse(StarletteJSONResponse):
+    """
+    Drop-in JSONResponse using the fastest available serializer
+    """
+
+    def render(self, content):
+        return dumps(content)
@@ -0,0 +1,12 @@
+import os
+
+# Production server with graceful restarts: `gunicorn -c gunicorn.conf.py app:app`.
+# `kill -HUP <master pid>` starts workers with the current code and config,
+# then lets the old workers finish their in-flight requests before exiting.
+bind = f"{os.environ.get('HOST', '0.0.0.0')}:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+worker_class = "uvicorn.workers.UvicornWorker"
+# Seconds old workers get to finish their requests on HUP or shutdown
+graceful_timeout = int(os.environ.get("GRACEFUL_TIMEOUT", "30"))
+# Each new worker imports the app itself, so a HUP picks up new code
+preload_app = False
@@ -0,0 +1,356 @@
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+
+import metrics
+from ratelimit import charging
+
+# Long-running work (project generation and analysis) runs as jobs instead of
+# inside the request. Jobs live in SQLite, so any worker process can pick them
+# up and they survive restarts; each process runs a small pool of threads.
+JOBS_PATH = os.environ.get(
+    "JOBS_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "jobs.sqlite3")
+)
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+# Finished jobs (and their files) are kept this long
+JOB_RESULT_TTL = int(os.environ.get("JOB_RESULT_TTL", str(24 * 3600)))
+# A running job whose process stops renewing its lease is handed to another worker
+JOB_LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", "60"))
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", "1.0"))
+JOB_GC_INTERVAL = 60
+
+TERMINAL_STATUSES = ("succeeded", "failed", "cancelled")
+
+_COLUMNS = (
+    "id, kind, params, status, progress, message, result, error, attempts, max_attempts, "
+    "artifacts, cancel_requested, client, created_at, updated_at, started_at, finished_at"
+)
+
+
+class JobCancelled(Exception):
+    """
+    The job was cancelled while it was running
+    """
+
+
+class Job:
+    """
+    Handle passed to a job handler for reporting progress
+    """
+
+    def __init__(self, queue, row):
+        self.queue = queue
+        self.id = row["id"]
+        self.kind = row["kind"]
+        self.params = row["params"]
+        self.attempts = row["attempts"]
+        self.max_attempts = row["max_attempts"]
+        # Rate-limit client that submitted the job, charged for its LLM tokens
+        self.client = row["client"]
+
+    def progress(self, fraction, message=""):
+        """
+        Record progress (0..1); raises JobCancelled if the job was cancelled
+        """
+        if self.queue.update_progress(self.id, fraction, message):
+            raise JobCancelled()
+
+    def add_artifact(self, path):
+        """
+        Register a file produced by the job, deleted when the job expires
+        """
+        self.queue.add_artifact(self.id, path)
+
+
+class JobQueue:
+    """
+    Durable job queue with a per-process worker pool, retries with backoff
+    and garbage collection of expired results
+    """
+
+    def __init__(self, path=JOBS_PATH, workers=JOB_WORKERS):
+        self.path = path
+        self.workers = workers
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._handlers = {}
+        self._local = threading.local()
+        self._wake = threading.Event()
+        self._threads = []
+        self._running = set()
+        self._lock = threading.Lock()
+        self._last_gc = 0
+
+    def _connection(self):
+        # One connection per thread and per process (workers may be forked)
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, kind TEXT NOT NULL, params TEXT NOT NULL, status TEXT NOT NULL, "
+            "progress REAL NOT NULL DEFAULT 0, message TEXT NOT NULL DEFAULT '', result TEXT, error TEXT, "
+            "attempts INTEGER NOT NULL DEFAULT 0, max_attempts INTEGER NOT NULL, "
+            "artifacts TEXT NOT NULL DEFAULT '[]', cancel_requested INTEGER NOT NULL DEFAULT 0, "
+            "run_after REAL NOT NULL, lease_until REAL, worker TEXT, client TEXT, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL, started_at REAL, finished_at REAL, expires_at REAL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, run_after)")
+        # Databases created before jobs recorded their client
+        if "client" not in {column["name"] for column in conn.execute("PRAGMA table_info(jobs)")}:
+            try:
+                conn.execute("ALTER TABLE jobs ADD COLUMN client TEXT")
+            except sqlite3.OperationalError:
+                pass  # added by another process in the meantime
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def handler(self, kind):
+        """
+        Decorator registering the function that runs jobs of a kind.
+        It is called as handler(job, **params) and returns the JSON result.
+        """
+        def decorator(func):
+            self._handlers[kind] = func
+            return func
+        return decorator
+
+    def submit(self, kind, params, max_attempts=JOB_MAX_ATTEMPTS, client=None):
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._connection().execute(
+            "INSERT INTO jobs (id, kind, params, status, max_attempts, run_after, client, created_at, updated_at) "
+            "VALUES (?, ?, ?, 'queued', ?, ?, ?, ?, ?)",
+            (job_id, kind, json.dumps(params), max_attempts, now, client, now, now)
+        )
+        metrics.incr(f"jobs.{kind}.submitted")
+        return job_id
+
+    def get(self, job_id, include_result=False):
+        row = self._connection().execute(f"SELECT {_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = {
+            "job_id": row["id"],
+            "kind": row["kind"],
+            "status": row["status"],
+            "progress": row["progress"],
+            "message": row["message"],
+            "attempts": row["attempts"],
+            "max_attempts": row["max_attempts"],
+            "error": row["error"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+            "started_at": row["started_at"],
+            "finished_at": row["finished_at"]
+        }
+        if include_result:
+            job["result"] = json.loads(row["result"]) if row["result"] is not None else None
+        return job
+
+    def cancel(self, job_id):
+        """
+        Cancel a job; a running job stops at its next progress report
+        """
+        now = time.time()
+        conn = self._connection()
+        cursor = conn.execute(
+            "UPDATE jobs SET status = 'cancelled', cancel_requested = 1, finished_at = ?, updated_at = ?, "
+            "expires_at = ? WHERE id = ? AND status = 'queued'",
+            (now, now, now + JOB_RESULT_TTL, job_id)
+        )
+        if cursor.rowcount:
+            return True
+        cursor = conn.execute(
+            "UPDATE jobs SET cancel_requested = 1, updated_at = ? WHERE id = ? AND status = 'running'",
+            (now, job_id)
+        )
+        return cursor.rowcount > 0
+
+    def update_progress(self, job_id, fraction, message):
+        """
+        Store progress and renew the lease; returns True if cancellation was requested
+        """
+        now = time.time()
+        row = self._connection().execute(
+            "UPDATE jobs SET progress = ?, message = ?, updated_at = ?, lease_until = ? "
+            "WHERE id = ? RETURNING cancel_requested",
+            (max(0.0, min(1.0, fraction)), message, now, now + JOB_LEASE_SECONDS, job_id)
+        ).fetchone()
+        return bool(row and row["cancel_requested"])
+
+    def add_artifact(self, job_id, path):
+        conn = self._connection()
+        row = conn.execute("SELECT artifacts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        artifacts = json.loads(row["artifacts"]) + [path]
+        conn.execute("UPDATE jobs SET artifacts = ? WHERE id = ?", (json.dumps(artifacts), job_id))
+
+    def wake(self):
+        """
+        Start the worker pool if needed and have an idle worker look for work now
+        """
+        self.start()
+        self._wake.set()
+
+    def start(self):
+        with self._lock:
+            if self._threads and self._threads[0].is_alive():
+                return
+            self._threads = [
+                threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+                for i in range(self.workers)
+            ]
+            self._threads.append(threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def _claim(self):
+        # A single UPDATE, so two workers (threads or processes) never claim
+        # the same job. Expired leases belong to workers that died mid-job.
+        now = time.time()
+        row = self._connection().execute(
+            f"UPDATE jobs SET status = 'running', attempts = attempts + 1, worker = ?, lease_until = ?, "
+            f"started_at = ?, updated_at = ? WHERE id = ("
+            f"SELECT id FROM jobs WHERE cancel_requested = 0 AND ("
+            f"(status = 'queued' AND run_after <= ?) OR (status = 'running' AND lease_until < ?)) "
+            f"ORDER BY created_at LIMIT 1) RETURNING {_COLUMNS}",
+            (self.worker_id, now + JOB_LEASE_SECONDS, now, now, now, now)
+        ).fetchone()
+        if row is None:
+            return None
+        return Job(self, {**dict(row), "params": json.loads(row["params"])})
+
+    def _work(self):
+        while True:
+            try:
+                self._collect_garbage()
+                job = self._claim()
+            except sqlite3.Error as e:
+                print(f"Job queue error: {str(e)}")
+                job = None
+            if job is None:
+                self._wake.wait(JOB_POLL_INTERVAL)
+                self._wake.clear()
+                continue
+            self._run(job)
+
+    def _run(self, job):
+        with self._lock:
+            self._running.add(job.id)
+        started = time.time()
+        try:
+            if job.attempts > job.max_attempts:
+                raise RuntimeError("Job exceeded its attempts (the worker running it stopped)")
+            with charging(job.client):
+                result = self._handlers[job.kind](job, **job.params)
+            self._finish(job, "succeeded", result=result)
+            metrics.incr(f"jobs.{job.kind}.succeeded")
+        except JobCancelled:
+            self._finish(job, "cancelled")
+            metrics.incr(f"jobs.{job.kind}.cancelled")
+        except Exception as e:
+            print(f"Job {job.id} ({job.kind}) failed on attempt {job.attempts}: {str(e)}")
+            if job.attempts < job.max_attempts:
+                if self._retry(job, str(e)):
+                    metrics.incr(f"jobs.{job.kind}.retried")
+                elif self._finish(job, "cancelled", error=str(e)):
+                    # Cancelled while this attempt was running
+                    metrics.incr(f"jobs.{job.kind}.cancelled")
+            else:
+                self._finish(job, "failed", error=str(e))
+                metrics.incr(f"jobs.{job.kind}.failed")
+        finally:
+            with self._lock:
+                self._running.discard(job.id)
+            metrics.incr(f"jobs.{job.kind}.seconds", round(time.time() - started, 3))
+
+    def _retry(self, job, error):
+        """
+        Queue the job again, with exponential backoff (2s, 4s, 8s, ...).
+        Returns False, leaving the job alone, if it was cancelled or this
+        worker no longer holds it.
+        """
+        now = time.time()
+        cursor = self._connection().execute(
+            "UPDATE jobs SET status = 'queued', error = ?, run_after = ?, lease_until = NULL, worker = NULL, "
+            "updated_at = ? WHERE id = ? AND status = 'running' AND worker = ? AND attempts = ? "
+            "AND cancel_requested = 0",
+            (error, now + 2 ** job.attempts, now, job.id, self.worker_id, job.attempts)
+        )
+        return cursor.rowcount > 0
+
+    def _finish(self, job, status, result=None, error=None):
+        # Only while this worker still holds the job: after its lease ran out
+        # another worker may have claimed it, and that attempt's outcome counts
+        now = time.time()
+        cursor = self._connection().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, progress = CASE WHEN ? = 'succeeded' THEN 1 "
+            "ELSE progress END, finished_at = ?, updated_at = ?, expires_at = ?, lease_until = NULL "
+            "WHERE id = ? AND status = 'running' AND worker = ? AND attempts = ?",
+            (status, json.dumps(result) if result is not None else None, error, status, now, now,
+             now + JOB_RESULT_TTL, job.id, self.worker_id, job.attempts)
+        )
+        if cursor.rowcount == 0:
+            print(f"Job {job.id} is no longer held by this worker; dropping its {status} outcome")
+        return cursor.rowcount > 0
+
+    def _heartbeat(self):
+        # Keeps the leases of this process's running jobs alive during long
+        # steps that report no progress (e.g. waiting for the model)
+        while True:
+            time.sleep(JOB_LEASE_SECONDS / 3)
+            with self._lock:
+                running = list(self._running)
+            for job_id in running:
+                try:
+                    self._connection().execute(
+                        "UPDATE jobs SET lease_until = ? WHERE id = ? AND status = 'running'",
+                        (time.time() + JOB_LEASE_SECONDS, job_id)
+                    )
+                except sqlite3.Error as e:
+                    print(f"Error renewing job lease {job_id}: {str(e)}")
+
+    def _collect_garbage(self):
+        now = time.time()
+        if now - self._last_gc < JOB_GC_INTERVAL:
+            return
+        self._last_gc = now
+        conn = self._connection()
+        # Cancelled while running on a worker that has since died, or queued
+        # for a retry after a cancel (claims skip those)
+        conn.execute(
+            "UPDATE jobs SET status = 'cancelled', finished_at = ?, updated_at = ?, expires_at = ? "
+            "WHERE cancel_requested = 1 AND ((status = 'running' AND lease_until < ?) OR status = 'queued')",
+            (now, now, now + JOB_RESULT_TTL, now)
+        )
+        expired = conn.execute(
+            "SELECT id, artifacts FROM jobs WHERE expires_at IS NOT NULL AND expires_at < ?", (now,)
+        ).fetchall()
+        for row in expired:
+            for path in json.loads(row["artifacts"]):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    print(f"Error removing job artifact {path}: {str(e)}")
+            conn.execute("DELETE FROM jobs WHERE id = ?", (row["id"],))
+        if expired:
+            metrics.incr("jobs.expired", len(expired))
+
+
+job_queue = JobQueue()
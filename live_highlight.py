@@ -0,0 +1,309 @@
+import os
+import html
+import hashlib
+import functools
+import threading
+from collections import OrderedDict
+
+# Incremental highlighting for live editors. The server keeps per-document
+# token state and, after an edit, re-lexes only from a line shortly before
+# the edit until the lexer is back in the state it had at that point of the
+# old text, then returns the changed lines as HTML. Documents are kept in
+# this process only: with several workers, every request for a document must
+# reach the worker that opened it (see the README), or it gets a resync.
+LIVE_MAX_DOCUMENTS = int(os.environ.get("LIVE_MAX_DOCUMENTS", "200"))
+LIVE_MAX_CHARS = int(os.environ.get("LIVE_MAX_CHARS", str(32 * 1024 * 1024)))
+
+# Lines re-lexed before the edit, since rules may look ahead past a newline
+LOOKBEHIND_LINES = 1
+# Extra lines re-lexed before the edit: a construct opened there without its
+# end (e.g. "/*" with no "*/") can be completed by the edit
+OPENER_LOOKBACK_LINES = 50
+
+
+class DocumentOutOfSync(Exception):
+    """
+    The client's base hash does not match the server's copy of the document
+    """
+
+
+@functools.lru_cache(maxsize=None)
+def _css_class(ttype):
+    # Same class names as HtmlFormatter, so the regular highlight CSS applies
+    from pygments.token import STANDARD_TYPES
+
+    fname = STANDARD_TYPES.get(ttype)
+    if fname is not None:
+        return fname
+    aname = ''
+    while fname is None:
+        aname = '-' + ttype[-1] + aname
+        ttype = ttype.parent
+        fname = STANDARD_TYPES.get(ttype)
+    return fname + aname
+
+
+def _render_line(tokens):
+    parts = []
+    for ttype, value in tokens:
+        css = _css_class(ttype)
+        value = html.escape(value, quote=False)
+        parts.append(f'<span class="{css}">{value}</span>' if css else value)
+    return "".join(parts)
+
+
+def _is_incremental(lexer):
+    # Only plain RegexLexers expose their state stack through the tokendefs;
+    # lexers that override get_tokens_unprocessed are re-lexed in full
+    from pygments.lexer import RegexLexer
+
+    return isinstance(lexer, RegexLexer) and type(lexer).get_tokens_unprocessed is RegexLexer.get_tokens_unprocessed
+
+
+def _transition(statestack, new_state):
+    # Mirrors the state handling of RegexLexer.get_tokens_unprocessed
+    if isinstance(new_state, tuple):
+        for state in new_state:
+            if state == '#pop':
+                if len(statestack) > 1:
+                    statestack.pop()
+            elif state == '#push':
+                statestack.append(statestack[-1])
+            else:
+                statestack.append(state)
+    elif isinstance(new_state, int):
+        if abs(new_state) >= len(statestack):
+            del statestack[1:]
+        else:
+            del statestack[new_state:]
+    elif new_state == '#push':
+        statestack.append(statestack[-1])
+
+
+def _lex_lines(lexer, text, stack=("root",), pos=0):
+    """
+    Lex text line by line from `pos`, yielding (tokens, state) for each line.
+    `state` is the lexer's state stack at the start of the line, or None when
+    a single match runs across the line break. This is the RegexLexer loop,
+    extended to record those states.
+    """
+    from pygments.token import Error, Whitespace, _TokenType
+
+    tokendefs = lexer._tokens
+    statestack = list(stack)
+    statetokens = tokendefs[statestack[-1]]
+    line, line_state, line_start = [], tuple(statestack), pos
+    while True:
+        for rexmatch, action, new_state in statetokens:
+            m = rexmatch(text, pos)
+            if m:
+                if action is None:
+                    tokens = []
+                elif type(action) is _TokenType:
+                    tokens = [(pos, action, m.group())]
+                else:
+                    tokens = list(action(lexer, m))
+                pos = m.end()
+                if new_state is not None:
+                    _transition(statestack, new_state)
+                    statetokens = tokendefs[statestack[-1]]
+                break
+        else:
+            if pos >= len(text):
+                break
+            if text[pos] == '\n':
+                # at EOL, reset state to "root"
+                statestack = ['root']
+                statetokens = tokendefs['root']
+                tokens = [(pos, Whitespace, '\n')]
+            else:
+                tokens = [(pos, Error, text[pos])]
+            pos += 1
+
+        for index, ttype, value in tokens:
+            pieces = value.split('\n')
+            for i, piece in enumerate(pieces):
+                if i > 0:
+                    yield line, line_state
+                    line, line_state = [], None
+                    line_start = index + sum(len(p) + 1 for p in pieces[:i])
+                if piece:
+                    line.append((ttype, piece))
+        # Nothing on this line consumed yet: the current stack is its start state
+        if pos == line_start:
+            line_state = tuple(statestack)
+    yield line, line_state
+
+
+def _lex_all(lexer, lines):
+    text = "\n".join(lines) + "\n"
+    if _is_incremental(lexer):
+        lexed = list(_lex_lines(lexer, text))
+        return [tokens for tokens, _ in lexed][:len(lines)], [state for _, state in lexed][:len(lines)]
+
+    line_tokens = [[]]
+    for ttype, value in lexer.get_tokens(text):
+        for i, piece in enumerate(value.split('\n')):
+            if i > 0:
+                line_tokens.append([])
+            if piece:
+                line_tokens[-1].append((ttype, piece))
+    return line_tokens[:len(lines)], [None] * len(lines)
+
+
+class LiveDocument:
+    """
+    Server-side copy of an editor buffer with its per-line tokens and HTML
+    """
+
+    def __init__(self, doc_id, language, code):
+        self.id = doc_id
+        self.language = language
+        # Pygments is imported on first use to keep the app's start-up fast
+        from pygments.lexers import get_lexer_by_name
+
+        try:
+            self.lexer = get_lexer_by_name(language, stripnl=False, ensurenl=False)
+        except Exception as lexer_error:
+            print(f"Lexer error for language '{language}': {str(lexer_error)}")
+            self.lexer = get_lexer_by_name("python", stripnl=False, ensurenl=False)
+        self.incremental = _is_incremental(self.lexer)
+        self.lines = code.replace("\r\n", "\n").split("\n")
+        self.tokens, self.states = _lex_all(self.lexer, self.lines)
+        self.html = [_render_line(tokens) for tokens in self.tokens]
+        self.hash = hashlib.sha1(code.encode("utf-8")).hexdigest()
+        self.chars = sum(len(line) for line in self.lines)
+        # Held from the hash check to the end of an edit
+        self.lock = threading.Lock()
+
+    def size(self):
+        return self.chars
+
+    def size_after(self, start, end, text):
+        """
+        Characters the document would have after replacing lines [start, end) with `text`
+        """
+        new_chars = sum(len(line) for line in text.replace("\r\n", "\n").split("\n"))
+        return self.chars - sum(len(line) for line in self.lines[start:end]) + new_chars
+
+    def apply_edit(self, start, end, text):
+        """
+        Replace lines [start, end) with `text` and re-highlight the affected
+        region. Returns (first line, number of old lines replaced, new HTML lines).
+        """
+        if not 0 <= start <= end <= len(self.lines):
+            raise ValueError(f"Edit range {start}-{end} is outside the document ({len(self.lines)} lines)")
+        new_lines = text.replace("\r\n", "\n").split("\n")
+        shift = len(new_lines) - (end - start)
+        old_length = len(self.lines)
+        self.chars += sum(len(line) for line in new_lines) - sum(len(line) for line in self.lines[start:end])
+        self.lines[start:end] = new_lines
+
+        if self.incremental:
+            first, old_count, tokens, states = self._relex_region(start, start + len(new_lines), shift, old_length)
+        else:
+            first, old_count, tokens, states = self._relex_all(shift)
+
+        new_html = [_render_line(line_tokens) for line_tokens in tokens]
+        self.tokens[first:first + old_count] = tokens
+        self.states[first:first + old_count] = states
+        self.html[first:first + old_count] = new_html
+        # Chained rather than a hash of the whole text, to stay O(edit size)
+        self.hash = hashlib.sha1(f"{self.hash}:{start}:{end}:{text}".encode("utf-8")).hexdigest()
+        return first, old_count, new_html
+
+    def _relex_region(self, start, edit_end, shift, old_length):
+        restart = max(0, min(start, old_length - 1) - LOOKBEHIND_LINES - OPENER_LOOKBACK_LINES)
+        # Then back to a line that starts at the bottom of the state stack:
+        # a line inside a multi-line match (state None) or in a nested state
+        # belongs to a construct opened earlier, which the edit may change
+        # (e.g. closing a string turns it into a docstring)
+        while restart > 0 and self.states[restart] != ("root",):
+            restart -= 1
+
+        # Lexing runs lazily over the rest of the text and stops as soon as
+        # a line after the edit starts in the same state as before the edit:
+        # from there on the old tokens are still valid. The whole rest of
+        # the text is passed, since a single match may span many lines.
+        # The previous line is included so lookbehinds see the same text
+        lines = self.lines
+        before = lines[restart - 1] + "\n" if restart > 0 else ""
+        text = before + "\n".join(lines[restart:]) + "\n"
+        tokens, states = [], []
+        line = restart
+        for line_tokens, state in _lex_lines(self.lexer, text, ("root",), len(before)):
+            if line >= len(lines):
+                break
+            if line >= edit_end and state is not None and state == self.states[line - shift]:
+                break
+            tokens.append(line_tokens)
+            states.append(state)
+            line += 1
+        return restart, len(tokens) - shift, tokens, states
+
+    def _relex_all(self, shift):
+        # Full re-lex, then keep only the lines between the unchanged head and tail
+        tokens, states = _lex_all(self.lexer, self.lines)
+        head = 0
+        while head < min(len(tokens), len(self.tokens)) and tokens[head] == self.tokens[head]:
+            head += 1
+        tail = 0
+        while (tail < min(len(tokens), len(self.tokens)) - head
+               and tokens[-1 - tail] == self.tokens[-1 - tail]):
+            tail += 1
+        changed = len(tokens) - tail
+        return head, changed - head - shift, tokens[head:changed], states[head:changed]
+
+
+class LiveDocumentStore:
+    """
+    LRU of live documents, bounded by count and total characters
+    """
+
+    def __init__(self, max_documents=LIVE_MAX_DOCUMENTS, max_chars=LIVE_MAX_CHARS):
+        self.max_documents = max_documents
+        self.max_chars = max_chars
+        self._documents = OrderedDict()
+        self._lock = threading.Lock()
+
+    def open(self, doc_id, language, code):
+        document = LiveDocument(doc_id, language, code)
+        if document.size() > self.max_chars:
+            raise ValueError(f"Document is larger than {self.max_chars} characters")
+        with self._lock:
+            self._documents[doc_id] = document
+            self._documents.move_to_end(doc_id)
+            self._evict()
+        return document
+
+    def edit(self, doc_id, base_hash, start, end, text):
+        with self._lock:
+            document = self._documents.get(doc_id)
+            if document is None:
+                raise DocumentOutOfSync(doc_id)
+            self._documents.move_to_end(doc_id)
+        # Concurrent edits with the same base hash (retries, two tabs): the
+        # first one applies, the others see the new hash and resync
+        with document.lock:
+            if document.hash != base_hash:
+                raise DocumentOutOfSync(doc_id)
+            if document.size_after(start, end, text) > self.max_chars:
+                raise ValueError(f"Document would be larger than {self.max_chars} characters")
+            patch = document.apply_edit(start, end, text)
+        with self._lock:
+            self._evict()
+        return document, patch
+
+    def close(self, doc_id):
+        with self._lock:
+            self._documents.pop(doc_id, None)
+
+    def _evict(self):
+        # The most recently used document (the one just opened or edited) is kept
+        total = sum(document.size() for document in self._documents.values())
+        while len(self._documents) > self.max_documents or (total > self.max_chars and len(self._documents) > 1):
+            _, oldest = self._documents.popitem(last=False)
+            total -= oldest.size()
+
+
+live_documents = LiveDocumentStore()
@@ -0,0 +1,266 @@
+import os
+import json
+import asyncio
+import threading
+from fastapi import Request
+
+import metrics
+from profiling import timed
+from startup import lazy_import
+
+requests = lazy_import("requests")
+
+OLLAMA_URL = os.environ.get("OLLAMA_URL", "http://localhost:11434/api/generate")
+MODEL_NAME = os.environ.get("MODEL_NAME", "codellama:7b-instruct")
+  # Using CodeLlama for code generation & debugging
+
+# How long Ollama keeps the model (and the KV cache of the last prompt) loaded
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "10m")
+
+
+def _untagged(model):
+    # "name" and "name:latest" are the same model to Ollama
+    return model[:-len(":latest")] if model.endswith(":latest") else model
+
+
+# Context window (num_ctx) of every generation and model load. Ollama
+# reloads a model whenever a request asks for a different num_ctx, so each
+# model always gets the same one. Per-model overrides go in MODEL_NUM_CTX,
+# e.g. "codellama:7b-instruct-q4_0=4096,codellama:34b-instruct=16384".
+OLLAMA_NUM_CTX = int(os.environ.get("OLLAMA_NUM_CTX", "8192"))
+MODEL_NUM_CTX = {
+    _untagged(name.strip()): int(value)
+    for name, _, value in (
+        item.partition("=") for item in os.environ.get("MODEL_NUM_CTX", "").split(",") if "=" in item
+    )
+}
+
+LLM_MODES = ("generate", "debug", "explain")
+
+# Generations sent to Ollama at once from this process; the rest wait in line
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "2"))
+# How often waiting requests check whether their client went away
+DISCONNECT_POLL_INTERVAL = float(os.environ.get("DISCONNECT_POLL_INTERVAL", "0.5"))
+
+
+def num_ctx_for(model):
+    """
+    The fixed context window requested for `model`
+    """
+    return MODEL_NUM_CTX.get(_untagged(model), OLLAMA_NUM_CTX)
+
+
+class OllamaError(Exception):
+    """
+    Ollama answered, but not with a usable generation
+    """
+
+
+class GenerationCancelled(Exception):
+    """
+    The generation was aborted before Ollama finished it
+    """
+
+
+# Foreground (user-facing) generations in flight in this process. Background
+# work such as prefetching registers a callback to be shed when one starts.
+_foreground_active = 0
+_foreground_lock = threading.Lock()
+_shed_callbacks = []
+
+
+def on_foreground_start(callback):
+    """
+    Register a callback run whenever a foreground generation starts
+    """
+    _shed_callbacks.append(callback)
+
+
+def foreground_active():
+    return _foreground_active
+
+
+_llm_slots = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+
+
+def _acquire_slot(cancel_event):
+    if cancel_event is None:
+        _llm_slots.acquire()
+        return
+    while not _llm_slots.acquire(timeout=0.1):
+        if cancel_event.is_set():
+            raise GenerationCancelled()
+
+
+async def cancel_on_disconnect(request: Request):
+    """
+    FastAPI dependency yielding an event that is set once the client
+    disconnects, so the generation serving it can be aborted
+    """
+    cancel_event = threading.Event()
+
+    async def watch():
+        while not cancel_event.is_set():
+            if await request.is_disconnected():
+                cancel_event.set()
+                return
+            await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+
+    watcher = asyncio.create_task(watch())
+    try:
+        yield cancel_event
+    finally:
+        watcher.cancel()
+
+
+def build_prompt(mode, language, input_text, follow_up=False, examples=None, brief=False):
+    """
+    Build the prompt for a mode, or None if the mode is not supported.
+    Follow-up turns in a session may omit the code, which then refers to
+    the code already in the conversation. Examples retrieved from the
+    team's snippets are added to generate prompts as few-shot context.
+    `brief` asks for a short explanation, for snippets of a few lines.
+    """
+    if follow_up and not input_text.strip():
+        if mode == "debug":
+            return f"Debug and fix the {language} code above. Return the corrected code."
+        if mode == "explain":
+            return f"Explain the {language} code above in detail, step by step, in language a beginner would understand."
+        if mode == "generate":
+            return f"Rewrite the {language} code above as clean, well-documented code."
+        return None
+
+    # Define prompts based on mode (generate, debug, or explain)
+    if mode == "generate":
+        prompt = f"Write a clean, well-documented {language} code for: {input_text}"
+        if examples:
+            prompt += "\n\nHere are related examples from our team's codebase; follow their conventions where relevant:"
+            for example in examples:
+                prompt += f"\n```{language}\n{example}\n```"
+        return prompt
+    elif mode == "debug":
+        return f"Debug and fix the following {language} code:\n{input_text}"
+    elif mode == "explain" and brief:
+        return f"""Explain what the following {language} code does in a few sentences:
+```
+{input_text}
+```
+
+Mention any bug or non-obvious behaviour. Do not restate the code line by line."""
+    elif mode == "explain":
+        return f"""Explain the following {language} code in detail:
+```
+{input_text}
+```
+
+Please include:
+1. What the code does overall
+2. How it works step by step
+3. Explanation of any complex or non-obvious parts
+4. Any potential issues or improvements
+
+Format your explanation in clear, concise language that would help a beginner understand the code."""
+    return None
+
+
+def generate(prompt, model=MODEL_NAME, context=None, keep_alive=None, options=None, cancel_event=None,
+             background=False, on_text=None):
+    """
+    Run a generation and return Ollama's JSON reply.
+    Passing the `context` from a previous reply lets Ollama continue that
+    conversation without re-encoding it. `options` are Ollama model options
+    such as num_predict or temperature. With a `cancel_event` the reply is
+    streamed so the generation can be aborted between tokens, or while it
+    still waits for one of the LLM_MAX_CONCURRENCY slots; closing the
+    connection makes Ollama stop generating. `on_text` is called with each
+    piece of the response text as it arrives.
+    """
+    global _foreground_active
+    payload = {"model": model, "prompt": prompt, "stream": cancel_event is not None}
+    if context:
+        payload["context"] = list(context)
+    if keep_alive:
+        payload["keep_alive"] = keep_alive
+    if options:
+        payload["options"] = options
+
+    if not background:
+        with _foreground_lock:
+            _foreground_active += 1
+    try:
+        if not background:
+            # Inside the try, so a failing callback still releases the count
+            for callback in _shed_callbacks:
+                callback()
+        try:
+            _acquire_slot(cancel_event)
+        except GenerationCancelled:
+            metrics.incr("llm.cancelled_queued")
+            raise
+        try:
+            with timed("llm"):
+                if cancel_event is None:
+                    # Send the request to Ollama without streaming (to avoid potential streaming issues)
+                    response = requests.post(
+                        OLLAMA_URL,
+                        json=payload,
+                        headers={"Content-Type": "application/json"}
+                    )
+                    _check_status(response)
+                    json_response = response.json()
+                    if on_text is not None:
+                        on_text(json_response.get("response", ""))
+                else:
+                    json_response = _generate_streaming(payload, cancel_event, on_text)
+        except GenerationCancelled:
+            metrics.incr("llm.cancelled_generating")
+            raise
+        finally:
+            _llm_slots.release()
+    finally:
+        if not background:
+            with _foreground_lock:
+                _foreground_active -= 1
+
+    if "response" not in json_response:
+        print("Unexpected response format:", json_response)
+        raise OllamaError("No valid response received from Ollama.")
+    return json_response
+
+
+def _check_status(response):
+    # Check if the request was successful
+    if response.status_code != 200:
+        print(f"Ollama API error: {response.status_code} - {response.text}")
+        raise OllamaError(f"Ollama API returned error: {response.text}")
+
+
+def _generate_streaming(payload, cancel_event, on_text=None):
+    """
+    Collect a streamed generation into a single reply, like stream=False would return
+    """
+    if cancel_event.is_set():
+        raise GenerationCancelled()
+
+    parts = []
+    with requests.post(OLLAMA_URL, json=payload, headers={"Content-Type": "application/json"}, stream=True) as response:
+        _check_status(response)
+        for line in response.iter_lines():
+            if cancel_event.is_set():
+                raise GenerationCancelled()
+            if not line:
+                continue
+            chunk = json.loads(line)
+            if "error" in chunk:
+                raise OllamaError(f"Ollama API returned error: {chunk['error']}")
+            parts.append(chunk.get("response", ""))
+            if on_text is not None and parts[-1]:
+                on_text(parts[-1])
+            if chunk.get("done"):
+                chunk["response"] = "".join(parts)
+                return chunk
+    if cancel_event.is_set():
+        raise GenerationCancelled()
+    # Ollama closed the stream early (crash, restart, proxy timeout): the text is truncated
+    print(f"Ollama stream ended without completing ({len(parts)} chunks received)")
+    raise OllamaError("Ollama stream ended before the generation completed.")
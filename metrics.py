@@ -0,0 +1,103 @@
+import os
+import time
+import atexit
+import sqlite3
+import threading
+from collections import Counter
+
+from shared_store import store
+
+# Counter increments are buffered in-process and flushed to the shared store
+# in the background, so hot paths never wait on a SQLite write.
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", "1.0"))
+
+_pending = Counter()
+_pending_lock = threading.Lock()
+_flusher = None
+
+
+def _flush():
+    with _pending_lock:
+        pending = dict(_pending)
+        _pending.clear()
+    for name, amount in pending.items():
+        try:
+            store.incr(name, amount)
+        except sqlite3.Error as e:
+            print(f"Error updating metric {name}: {str(e)}")
+
+
+def _flush_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        _flush()
+
+
+atexit.register(_flush)
+
+
+def incr(name, amount=1):
+    """
+    Increment a counter shared by all worker processes
+    """
+    global _flusher
+    with _pending_lock:
+        _pending[name] += amount
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_loop, name="metrics-flush", daemon=True)
+            _flusher.start()
+
+
+def set_gauge(name, value):
+    """
+    Record the latest value of a gauge shared by all worker processes
+    """
+    try:
+        store.set_value(name, value)
+    except sqlite3.Error as e:
+        print(f"Error updating metric {name}: {str(e)}")
+
+
+def get_metrics():
+    """
+    Snapshot of all counters and gauges
+    """
+    _flush()
+    return {
+        "pid": os.getpid(),
+        "counters": store.counters()
+    }
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware counting requests per route and status class
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._routes = None
+
+    def _route_name(self, scope):
+        # Only name routes the app actually serves, so probing random URLs
+        # cannot create unbounded numbers of counters
+        if self._routes is None:
+            self._routes = {getattr(r, "path", "/").split("/")[1] for r in scope["app"].routes}
+        name = scope["path"].split("/")[1]
+        if name not in self._routes:
+            return "other"
+        return name or "root"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        route = self._route_name(scope)
+
+        async def send_with_count(message):
+            if message["type"] == "http.response.start":
+                incr(f"requests.{route}.{message['status'] // 100}xx")
+            await send(message)
+
+        await self.app(scope, receive, send_with_count)
@@ -0,0 +1,414 @@
+import os
+import time
+import sqlite3
+import threading
+from datetime import datetime
+
+import metrics
+from llm import OLLAMA_URL, MODEL_NAME, OLLAMA_KEEP_ALIVE, num_ctx_for
+from shared_store import store
+from startup import lazy_import
+
+requests = lazy_import("requests")
+
+# Model lifecycle: preload models at start-up and keep the ones with recent
+# traffic loaded, so users do not pay Ollama's multi-second model load after
+# it idled a model out. Models are only loaded into free memory slots; the
+# manager never evicts a model itself, and requests avoid switching to a
+# cold model while every slot holds a model in active use. With several
+# workers, only the one holding the "model-manager" lease in the shared store
+# loads and pings models; every worker sees the others' traffic through the
+# shared models.<name>.requests counters.
+MODEL_MANAGER_ENABLED = os.environ.get("MODEL_MANAGER_ENABLED", "1").lower() not in ("0", "false", "no")
+# Models loaded at start-up, comma-separated
+MODEL_PRELOAD = [m.strip() for m in os.environ.get("MODEL_PRELOAD", MODEL_NAME).split(",") if m.strip()]
+# How many models fit in the Ollama server's memory at once (the regular
+# and the small routing model by default)
+MODEL_MAX_RESIDENT = int(os.environ.get("MODEL_MAX_RESIDENT", "2"))
+# Seconds between maintenance passes (residency check and keep-alive pings)
+MODEL_CHECK_INTERVAL = float(os.environ.get("MODEL_CHECK_INTERVAL", "60"))
+# Models without traffic for this long are no longer kept loaded
+MODEL_IDLE_TIMEOUT = float(os.environ.get("MODEL_IDLE_TIMEOUT", str(30 * 60)))
+# A model used this recently is never displaced to load another one
+MODEL_MIN_RESIDENCY = float(os.environ.get("MODEL_MIN_RESIDENCY", "300"))
+# Half-life of the traffic score used to rank models for the free slots
+MODEL_TRAFFIC_HALF_LIFE = 600.0
+# Replies whose load_duration exceeds this (seconds) paid for a model load
+MODEL_LOAD_THRESHOLD = 0.5
+# Use the in-memory StubBackend instead of Ollama (MODEL_BACKEND=stub)
+MODEL_BACKEND = os.environ.get("MODEL_BACKEND", "ollama")
+
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_keep_alive(value):
+    """
+    Seconds for an Ollama keep_alive value such as "10m", "1h" or 300
+    """
+    value = str(value).strip()
+    for unit in ("ms", "s", "m", "h"):
+        if value.endswith(unit):
+            return float(value[:-len(unit)]) * _DURATION_UNITS[unit]
+    return float(value)
+
+
+def model_key(name):
+    """
+    Ollama's name for a model: an untagged name means the `latest` tag
+    """
+    return name if ":" in name else name + ":latest"
+
+
+class OllamaBackend:
+    """
+    Loads, unloads and lists the models of the configured Ollama server
+    """
+
+    def __init__(self, base_url=None):
+        self.base_url = base_url or OLLAMA_URL.rsplit("/api/", 1)[0]
+
+    def load(self, model, keep_alive):
+        """
+        Load a model (or refresh its keep_alive); returns seconds spent loading
+        """
+        # A generate request without a prompt only loads the model. It asks
+        # for the num_ctx requests use, or the next request would reload it.
+        response = requests.post(
+            f"{self.base_url}/api/generate",
+            json={"model": model, "keep_alive": keep_alive, "options": {"num_ctx": num_ctx_for(model)}},
+            timeout=600
+        )
+        response.raise_for_status()
+        return response.json().get("load_duration", 0) / 1e9
+
+    def unload(self, model):
+        requests.post(f"{self.base_url}/api/generate", json={"model": model, "keep_alive": 0}, timeout=60)
+
+    def resident(self):
+        """
+        Loaded models as {name: expiry timestamp or None}
+        """
+        response = requests.get(f"{self.base_url}/api/ps", timeout=10)
+        response.raise_for_status()
+        models = {}
+        for item in response.json().get("models", []):
+            expires_at = None
+            try:
+                expires_at = datetime.fromisoformat(item["expires_at"]).timestamp()
+            except (KeyError, ValueError, TypeError):
+                pass
+            models[model_key(item.get("name") or item.get("model"))] = expires_at
+        return models
+
+
+class StubBackend:
+    """
+    In-memory stand-in for an Ollama server holding `capacity` models, each
+    costing `load_seconds` to load. Used with MODEL_BACKEND=stub to run the
+    manager without Ollama; `loads` lists every model load in order.
+    """
+
+    def __init__(self, capacity=MODEL_MAX_RESIDENT, load_seconds=2.0, clock=time.time):
+        self.capacity = capacity
+        self.load_seconds = load_seconds
+        self.clock = clock
+        self.loads = []
+        self._models = {}  # name -> [expires_at, last_used]
+        self._lock = threading.Lock()
+
+    def _expire(self):
+        now = self.clock()
+        for name in [n for n, (expires_at, _) in self._models.items() if expires_at <= now]:
+            del self._models[name]
+
+    def load(self, model, keep_alive):
+        with self._lock:
+            self._expire()
+            now = self.clock()
+            model = model_key(model)
+            loaded = model not in self._models
+            if loaded:
+                if len(self._models) >= self.capacity:
+                    # Like Ollama: make room by unloading the least recently used model
+                    del self._models[min(self._models, key=lambda n: self._models[n][1])]
+                self.loads.append(model)
+            self._models[model] = [now + parse_keep_alive(keep_alive), now]
+            return self.load_seconds if loaded else 0.0
+
+    def unload(self, model):
+        with self._lock:
+            self._models.pop(model_key(model), None)
+
+    def resident(self):
+        with self._lock:
+            self._expire()
+            return {name: expires_at for name, (expires_at, _) in self._models.items()}
+
+
+class _ModelState:
+    __slots__ = ("requests", "loads", "load_seconds", "score", "scored_at", "last_active", "last_load", "last_ping")
+
+    def __init__(self, now):
+        self.requests = 0
+        self.loads = 0
+        self.load_seconds = 0.0
+        self.score = 0.0
+        self.scored_at = now
+        self.last_active = None
+        self.last_load = None
+        self.last_ping = None
+
+    def decayed_score(self, now):
+        return self.score * 0.5 ** ((now - self.scored_at) / MODEL_TRAFFIC_HALF_LIFE)
+
+
+class ModelManager:
+    """
+    Keeps the models with recent traffic loaded on the Ollama server
+    """
+
+    def __init__(self, backend=None, preload=MODEL_PRELOAD, max_resident=MODEL_MAX_RESIDENT,
+                 keep_alive=OLLAMA_KEEP_ALIVE, clock=time.time):
+        self.backend = backend or (StubBackend() if MODEL_BACKEND == "stub" else OllamaBackend())
+        self.preload = [model_key(m) for m in preload]
+        self.max_resident = max_resident
+        self.keep_alive = keep_alive
+        self.keep_alive_seconds = parse_keep_alive(keep_alive)
+        self.clock = clock
+        self._models = {}
+        self._resident = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.leader = False
+        # Shared request counters as last seen, and this worker's own requests
+        # since then, to tell the other workers' traffic apart
+        self._shared_seen = {}
+        self._own_requests = {}
+
+    def _state(self, model):
+        state = self._models.get(model)
+        if state is None:
+            state = self._models[model] = _ModelState(self.clock())
+        return state
+
+    def _record_load(self, model, seconds):
+        state = self._state(model)
+        state.loads += 1
+        state.load_seconds += seconds
+        state.last_load = self.clock()
+        metrics.incr("models.loads")
+        metrics.incr(f"models.{model}.loads")
+
+    def record_use(self, model, reply=None):
+        """
+        Note a generation served by `model`; `reply` is Ollama's reply, whose
+        load_duration tells whether the request had to wait for a load
+        """
+        model = model_key(model)
+        now = self.clock()
+        load_seconds = (reply or {}).get("load_duration", 0) / 1e9
+        with self._lock:
+            state = self._state(model)
+            state.requests += 1
+            state.score = state.decayed_score(now) + 1
+            state.scored_at = now
+            state.last_active = now
+            self._own_requests[model] = self._own_requests.get(model, 0) + 1
+            if load_seconds > MODEL_LOAD_THRESHOLD:
+                # A user waited for this load
+                self._record_load(model, load_seconds)
+                metrics.incr("models.cold_requests")
+            self._resident[model] = now + self.keep_alive_seconds
+        metrics.incr(f"models.{model}.requests")
+
+    def should_avoid(self, model):
+        """
+        Whether serving a request with `model` would displace a model in
+        active use: it is not loaded, every slot is taken, and each loaded
+        model was used within MODEL_MIN_RESIDENCY
+        """
+        model = model_key(model)
+        now = self.clock()
+        with self._lock:
+            if model in self._resident or len(self._resident) < self.max_resident:
+                return False
+            for other in self._resident:
+                state = self._models.get(other)
+                if state is None or state.last_active is None or now - state.last_active > MODEL_MIN_RESIDENCY:
+                    return False
+        return True
+
+    def _load(self, model, reason):
+        # Pings and reloads do not count as traffic, so idle models still expire
+        try:
+            seconds = self.backend.load(model, self.keep_alive)
+        except Exception as e:
+            print(f"Model {reason} failed for {model}: {str(e)}")
+            metrics.incr("models.load_errors")
+            return False
+        with self._lock:
+            state = self._state(model)
+            if reason == "preload":
+                state.last_active = self.clock()
+            state.last_ping = self.clock()
+            if seconds > MODEL_LOAD_THRESHOLD:
+                self._record_load(model, seconds)
+            self._resident[model] = self.clock() + self.keep_alive_seconds
+        metrics.incr(f"models.{reason}s")
+        return True
+
+    def _refresh_resident(self):
+        try:
+            resident = self.backend.resident()
+        except Exception as e:
+            print(f"Listing loaded models failed: {str(e)}")
+            return False
+        with self._lock:
+            self._resident = dict(resident)
+        metrics.set_gauge("models.resident", len(resident))
+        return True
+
+    def preload_models(self):
+        """
+        Load the MODEL_PRELOAD models into the free slots
+        """
+        if not self._refresh_resident():
+            return
+        for model in self.preload:
+            if model in self._resident:
+                with self._lock:
+                    self._state(model).last_active = self.clock()
+            elif len(self._resident) < self.max_resident:
+                print(f"Preloading model {model}")
+                self._load(model, "preload")
+            else:
+                print(f"Not preloading {model}: {self.max_resident} model(s) already loaded")
+
+    def tick(self):
+        """
+        One maintenance pass: ping the loaded models with recent traffic
+        before they expire, and reload recently used models Ollama dropped
+        if a slot is free
+        """
+        if not self._refresh_resident():
+            return
+        now = self.clock()
+        with self._lock:
+            active = [
+                (state.decayed_score(now), model) for model, state in self._models.items()
+                if state.last_active is not None and now - state.last_active < MODEL_IDLE_TIMEOUT
+            ]
+            resident = dict(self._resident)
+        # Busiest models first; only as many as fit
+        active.sort(reverse=True)
+        for _, model in active[:self.max_resident]:
+            state = self._models[model]
+            if model in resident:
+                # Requests refresh keep_alive themselves; ping only when none came recently
+                if now - max(state.last_active, state.last_ping or 0) >= self.keep_alive_seconds / 2:
+                    self._load(model, "ping")
+            elif len(resident) < self.max_resident:
+                print(f"Reloading model {model} (used {now - state.last_active:.0f}s ago)")
+                if self._load(model, "reload"):
+                    resident[model] = None
+            else:
+                metrics.incr("models.skipped_loads")
+
+    def _merge_shared_traffic(self):
+        """
+        Count the requests other workers served since the last pass as
+        traffic, from the shared models.<name>.requests counters
+        """
+        with self._lock:
+            own, self._own_requests = self._own_requests, {}
+        # get_metrics() flushes this worker's pending counts first
+        counters = metrics.get_metrics()["counters"]
+        now = self.clock()
+        with self._lock:
+            for name, value in counters.items():
+                if not (name.startswith("models.") and name.endswith(".requests")):
+                    continue
+                model = name[len("models."):-len(".requests")]
+                seen = self._shared_seen.get(model)
+                self._shared_seen[model] = value
+                if seen is None:
+                    # First pass: only note where the counter stands
+                    continue
+                others = value - seen - own.get(model, 0)
+                if others > 0:
+                    state = self._state(model)
+                    state.score = state.decayed_score(now) + others
+                    state.scored_at = now
+                    state.last_active = now
+
+    def _take_lead(self):
+        try:
+            leader = store.acquire_lease("model-manager", str(os.getpid()), MODEL_CHECK_INTERVAL * 3)
+        except sqlite3.Error as e:
+            print(f"Model manager lease failed: {str(e)}")
+            leader = False
+        if leader != self.leader:
+            print(f"Model manager: {'leading' if leader else 'following'} in process {os.getpid()}")
+        self.leader = leader
+        return leader
+
+    def _run(self):
+        preloaded = False
+        while True:
+            try:
+                self._merge_shared_traffic()
+                if not self._take_lead():
+                    # Another worker loads and pings; keep the view of loaded models current
+                    self._refresh_resident()
+                elif not preloaded:
+                    self.preload_models()
+                    preloaded = True
+                else:
+                    self.tick()
+            except Exception as e:
+                print(f"Model manager error: {str(e)}")
+            if self._stop.wait(MODEL_CHECK_INTERVAL):
+                return
+
+    def start(self):
+        """
+        Preload models and keep them warm in a background thread
+        """
+        if not MODEL_MANAGER_ENABLED or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="model-manager", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def status(self):
+        """
+        Loaded models and per-model traffic and load counts
+        """
+        now = self.clock()
+        with self._lock:
+            return {
+                "leader": self.leader,
+                "max_resident": self.max_resident,
+                "keep_alive": self.keep_alive,
+                "resident": [
+                    {"model": model, "expires_in": round(expires_at - now) if expires_at else None}
+                    for model, expires_at in sorted(self._resident.items())
+                ],
+                "models": {
+                    model: {
+                        "requests": state.requests,
+                        "loads": state.loads,
+                        "load_seconds": round(state.load_seconds, 2),
+                        "traffic_score": round(state.decayed_score(now), 2),
+                        "idle_seconds": round(now - state.last_active) if state.last_active else None,
+                        "last_load": state.last_load
+                    }
+                    for model, state in sorted(self._models.items())
+                }
+            }
+
+
+model_manager = ModelManager()
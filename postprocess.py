@@ -0,0 +1,173 @@
+import re
+import ast
+import json
+
+import metrics
+from analyzers import get_analyzer, significant_tokens, GenericAnalyzer
+from shared_store import memoize
+from utils import format_code_with_highlighting, normalize_highlight_language
+
+# Post-processing of model replies: markdown code fences are picked out of
+# the reply while it streams, and each block is syntax-checked and
+# highlighted as soon as its closing fence arrives, so the client gets the
+# pre-highlighted blocks with the reply instead of highlighting them itself.
+
+# An opening or closing fence line: ``` or ~~~ (3 or more), then an optional info string
+FENCE_RE = re.compile(r"^ {0,3}(`{3,}|~{3,})[ \t]*([^\s`]*)[^`\n]*$")
+
+_BRACKETS = {")": "(", "]": "[", "}": "{"}
+
+
+def _check_python(code, language):
+    try:
+        ast.parse(code)
+    except SyntaxError as e:
+        return {"line": e.lineno, "message": e.msg}
+    return None
+
+
+def _check_json(code, language):
+    try:
+        json.loads(code)
+    except ValueError as e:
+        return {"line": getattr(e, "lineno", None), "message": str(e)}
+    return None
+
+
+def _check_brackets(code, language):
+    # Balanced (), [] and {} outside strings and comments
+    stack = []
+    for tok in significant_tokens(code, language):
+        if tok.kind != "punct":
+            continue
+        if tok.value in "([{":
+            stack.append(tok)
+        elif tok.value in _BRACKETS:
+            if not stack or stack[-1].value != _BRACKETS[tok.value]:
+                return {"line": tok.line, "message": f"Unexpected '{tok.value}'"}
+            stack.pop()
+    if stack:
+        return {"line": stack[-1].line, "message": f"Unclosed '{stack[-1].value}'"}
+    return None
+
+
+# Syntax checks by language; brace languages with an analyzer get a bracket check
+SYNTAX_CHECKS = {
+    "python": _check_python,
+    "python3": _check_python,
+    "json": _check_json
+}
+
+
+def syntax_check(language):
+    """
+    Syntax check function for a language, or None if it has none
+    """
+    check = SYNTAX_CHECKS.get(language)
+    if check is None:
+        analyzer = get_analyzer(language)
+        if analyzer is not GenericAnalyzer.instance and analyzer.block_style == "braces":
+            check = _check_brackets
+    return check
+
+
+@memoize("code_blocks")
+def process_block(code, language):
+    """
+    Syntax check and highlighted HTML for one code block
+    """
+    check = syntax_check(language)
+    # Errors are {"line", "message"}; valid is None for languages without a check
+    error = check(code, language) if check else None
+    return {
+        "valid": (error is None) if check else None,
+        "error": error,
+        "html": format_code_with_highlighting(code, language)["html"]
+    }
+
+
+class CodeBlockExtractor:
+    """
+    Incrementally extracts fenced code blocks from a reply fed to it in
+    chunks; `language` is used for fences without an info string
+    """
+
+    def __init__(self, language):
+        self.language = normalize_highlight_language(language)
+        self.blocks = []
+        self._pending = ""
+        self._length = 0
+        self._line_start = 0
+        self._fence = None
+        self._block_start = 0
+        self._block_language = None
+        self._block_lines = []
+
+    def feed(self, text):
+        """
+        Add the next chunk of the reply; complete blocks are processed now
+        """
+        self._length += len(text)
+        self._pending += text
+        while "\n" in self._pending:
+            line, self._pending = self._pending.split("\n", 1)
+            self._line(line)
+
+    def _line(self, line):
+        start = self._line_start
+        self._line_start += len(line) + 1
+        match = FENCE_RE.match(line)
+        if self._fence is None:
+            if match:
+                self._fence = match.group(1)
+                self._block_start = start
+                self._block_language = normalize_highlight_language(match.group(2)) if match.group(2) else self.language
+                self._block_lines = []
+        elif match and match.group(1)[0] == self._fence[0] and len(match.group(1)) >= len(self._fence) \
+                and not match.group(2):
+            self._finish(start + len(line), closed=True)
+        else:
+            self._block_lines.append(line)
+
+    def _finish(self, end, closed):
+        code = "\n".join(self._block_lines)
+        block = {
+            "index": len(self.blocks),
+            "language": self._block_language,
+            "code": code,
+            # Offsets of the whole fenced block, fences included, in the reply
+            "start": self._block_start,
+            "end": end,
+            "closed": closed
+        }
+        self._fence = None
+        try:
+            block.update(process_block(code, block["language"]))
+        except Exception as e:
+            print(f"Error processing code block: {str(e)}")
+            block.update({"valid": None, "error": None, "html": None})
+        metrics.incr("postprocess.blocks")
+        if block["valid"] is False:
+            metrics.incr("postprocess.invalid_blocks")
+        self.blocks.append(block)
+
+    def close(self):
+        """
+        End of the reply: process a trailing line and an unclosed block
+        (e.g. the model hit num_predict mid-block); returns all blocks
+        """
+        if self._pending:
+            line, self._pending = self._pending, ""
+            self._line(line)
+        if self._fence is not None:
+            self._finish(self._length, closed=False)
+        return self.blocks
+
+
+def extract_code_blocks(text, language):
+    """
+    Processed code blocks of a complete reply
+    """
+    extractor = CodeBlockExtractor(language)
+    extractor.feed(text)
+    return extractor.close()
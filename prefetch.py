@@ -0,0 +1,195 @@
+import os
+import time
+import sqlite3
+import threading
+
+import llm
+import metrics
+from ratelimit import charging, current_client
+from routing import choose_route, generate_routed
+from shared_store import store, cache_key
+from utils import analyze_code_structure, check_security_issues, format_code_with_highlighting
+
+PREFETCH_ENABLED = os.environ.get("PREFETCH_ENABLED", "1") == "1"
+# Cancel a prefetch nobody has asked about for this long
+PREFETCH_IDLE_TIMEOUT = float(os.environ.get("PREFETCH_IDLE_TIMEOUT", "60"))
+# How long a finished prefetch result can be handed over
+PREFETCH_RESULT_TTL = int(os.environ.get("PREFETCH_RESULT_TTL", "600"))
+# Never start prefetching while this many user requests are generating
+PREFETCH_MAX_FOREGROUND = int(os.environ.get("PREFETCH_MAX_FOREGROUND", "1"))
+# Longest a real request waits for an in-flight prefetch before giving up on it
+PREFETCH_HANDOFF_TIMEOUT = float(os.environ.get("PREFETCH_HANDOFF_TIMEOUT", "120"))
+
+
+def prefetch_key(language, code):
+    return cache_key("explain", language, code.strip())
+
+
+class PrefetchTask:
+    """
+    A speculative explain generation for one client's pasted code
+    """
+
+    def __init__(self, key, client_id, language, code):
+        self.key = key
+        self.client_id = client_id
+        self.language = language
+        self.code = code
+        # Rate-limit client of the request that started it, charged for its tokens
+        self.charge_to = current_client()
+        self.cancel_event = threading.Event()
+        self.done = threading.Event()
+        self.result = None
+        self.last_seen = time.time()
+        # Set once a real request is waiting on this task, so it is no longer shed
+        self.claimed = False
+
+
+class PrefetchManager:
+    """
+    Runs low-priority explain generations ahead of the user's click, and
+    hands the result over when the matching /generate_code request arrives
+    """
+
+    def __init__(self):
+        self._tasks = {}
+        self._by_client = {}
+        self._lock = threading.Lock()
+        self._reaper = None
+        llm.on_foreground_start(self.shed)
+
+    def start(self, client_id, language, code):
+        if not PREFETCH_ENABLED:
+            return "disabled"
+
+        key = prefetch_key(language, code)
+        with self._lock:
+            # A new paste or edit from the same client makes the old prefetch stale
+            previous = self._by_client.get(client_id)
+            if previous is not None and previous.key != key:
+                self._cancel(previous, "edited")
+
+            task = self._tasks.get(key)
+            if task is not None:
+                task.last_seen = time.time()
+                self._by_client[client_id] = task
+                return "running"
+
+        if self._cached_result(key) is not None:
+            return "ready"
+
+        # Warm the cheap caches right away; they are shared with other workers
+        analyze_code_structure(code, language)
+        check_security_issues(code, language)
+        format_code_with_highlighting(code, language)
+
+        if llm.foreground_active() >= PREFETCH_MAX_FOREGROUND:
+            metrics.incr("prefetch.shed")
+            return "shed"
+
+        task = PrefetchTask(key, client_id, language, code)
+        with self._lock:
+            self._tasks[key] = task
+            self._by_client[client_id] = task
+            self._ensure_reaper()
+        threading.Thread(target=self._run, args=(task,), name="prefetch", daemon=True).start()
+        metrics.incr("prefetch.started")
+        return "started"
+
+    def cancel(self, client_id):
+        with self._lock:
+            task = self._by_client.get(client_id)
+            if task is not None:
+                self._cancel(task, "cancelled")
+                return True
+        return False
+
+    def take(self, language, code, cancel_event=None):
+        """
+        Result for a real explain request, or None if nothing was prefetched.
+        Waits for a matching prefetch that is still running, unless the
+        waiting request is cancelled first.
+        """
+        key = prefetch_key(language, code)
+        result = self._cached_result(key)
+        if result is None:
+            with self._lock:
+                task = self._tasks.get(key)
+                if task is not None:
+                    task.claimed = True
+            if task is None or not self._wait(task, cancel_event):
+                return None
+            result = task.result
+        if result is not None:
+            metrics.incr("prefetch.hit")
+        return result
+
+    def _wait(self, task, cancel_event):
+        deadline = time.time() + PREFETCH_HANDOFF_TIMEOUT
+        while not task.done.wait(0.1):
+            if time.time() > deadline or (cancel_event is not None and cancel_event.is_set()):
+                task.claimed = False
+                return False
+        return True
+
+    def shed(self):
+        """
+        Drop prefetches no real request is waiting on; called when user work starts
+        """
+        with self._lock:
+            for task in list(self._tasks.values()):
+                if not task.claimed:
+                    self._cancel(task, "shed")
+
+    def _run(self, task):
+        try:
+            # Routed like the real request, so the handed-over answer is the same kind
+            route = choose_route("explain", task.code)
+            prompt = llm.build_prompt("explain", task.language, task.code, brief=route.brief)
+            with charging(task.charge_to):
+                reply, _ = generate_routed(route, prompt, cancel_event=task.cancel_event, background=True)
+            task.result = reply["response"]
+            store.set("prefetch", task.key, task.result, ttl=PREFETCH_RESULT_TTL)
+        except llm.GenerationCancelled:
+            pass
+        except Exception as e:
+            print(f"Prefetch failed: {str(e)}")
+        finally:
+            task.done.set()
+            with self._lock:
+                if self._tasks.get(task.key) is task:
+                    del self._tasks[task.key]
+                if self._by_client.get(task.client_id) is task:
+                    del self._by_client[task.client_id]
+
+    def _cancel(self, task, reason):
+        if not task.cancel_event.is_set():
+            task.cancel_event.set()
+            metrics.incr(f"prefetch.{reason}")
+        self._tasks.pop(task.key, None)
+        if self._by_client.get(task.client_id) is task:
+            del self._by_client[task.client_id]
+
+    def _cached_result(self, key):
+        try:
+            return store.get("prefetch", key)
+        except sqlite3.Error as e:
+            print(f"Error reading prefetch result: {str(e)}")
+            return None
+
+    def _ensure_reaper(self):
+        if self._reaper is None:
+            self._reaper = threading.Thread(target=self._reap_idle, name="prefetch-reaper", daemon=True)
+            self._reaper.start()
+
+    def _reap_idle(self):
+        while True:
+            time.sleep(min(PREFETCH_IDLE_TIMEOUT, 5))
+            cutoff = time.time() - PREFETCH_IDLE_TIMEOUT
+            with self._lock:
+                for task in list(self._tasks.values()):
+                    if not task.claimed and task.last_seen < cutoff:
+                        self._cancel(task, "idle")
+
+
+prefetcher = PrefetchManager()
@@ -0,0 +1,247 @@
+import os
+import re
+import sys
+import time
+import uuid
+import random
+import cProfile
+import threading
+import functools
+import contextvars
+from collections import Counter
+from contextlib import contextmanager
+
+# Profiling is opt-in: either send the header below with a request, or set a
+# sampling rate so a fraction of production traffic is profiled automatically.
+PROFILE_HEADER = b"x-profile"
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get("PROFILE_SAMPLE_INTERVAL", "0.005"))
+PROFILES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles")
+# Profile files kept; the oldest are deleted as new ones are saved
+PROFILES_MAX_FILES = int(os.environ.get("PROFILES_MAX_FILES", "200"))
+
+# Phases reported in the Server-Timing header, in display order
+SERVER_TIMING_PHASES = ("llm", "tokenize", "format", "disk", "zip")
+
+_current_profile = contextvars.ContextVar("current_profile", default=None)
+
+
+class RequestProfile:
+    """
+    Timing breakdown and profiler output for a single request
+    """
+
+    def __init__(self, path):
+        self.id = uuid.uuid4().hex[:12]
+        self.path = path
+        self.started = time.perf_counter()
+        self.total = None
+        self.phases = {}
+        self.files = []
+        self._lock = threading.Lock()
+
+    def add_phase(self, phase, seconds):
+        with self._lock:
+            self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def finish(self):
+        if self.total is None:
+            self.total = time.perf_counter() - self.started
+        return self.total
+
+    def server_timing(self):
+        """
+        Render the recorded phases as a Server-Timing header value
+        """
+        entries = []
+        for phase in SERVER_TIMING_PHASES:
+            if phase in self.phases:
+                entries.append(f"{phase};dur={self.phases[phase] * 1000:.1f}")
+        entries.append(f"total;dur={self.finish() * 1000:.1f}")
+        return ", ".join(entries)
+
+    def run(self, func, *args, **kwargs):
+        """
+        Run a handler under cProfile and a stack sampler, then save both outputs
+        """
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Only one cProfile can be active per interpreter on newer Pythons;
+            # concurrent profiled requests fall back to the sampler alone.
+            profiler = None
+
+        sampler = _StackSampler(threading.get_ident())
+        sampler.start()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            sampler.stop()
+            self._save(profiler, sampler.stacks)
+
+    def _save(self, profiler, stacks):
+        try:
+            os.makedirs(PROFILES_DIR, exist_ok=True)
+            if profiler is not None:
+                prof_path = os.path.join(PROFILES_DIR, f"{self.id}.prof")
+                profiler.dump_stats(prof_path)
+                self.files.append(os.path.basename(prof_path))
+
+            # Collapsed stacks, one "frame;frame;frame count" per line, the
+            # input format of flamegraph.pl and speedscope
+            folded_path = os.path.join(PROFILES_DIR, f"{self.id}.folded")
+            with open(folded_path, "w", encoding="utf-8") as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            self.files.append(os.path.basename(folded_path))
+            _prune_profiles()
+        except Exception as e:
+            print(f"Error saving profile {self.id}: {str(e)}")
+
+
+def _prune_profiles():
+    # Oldest first; files deleted meanwhile by another worker are skipped
+    paths = []
+    for entry in os.scandir(PROFILES_DIR):
+        if entry.name.endswith((".prof", ".folded")):
+            try:
+                paths.append((entry.stat().st_mtime, entry.path))
+            except FileNotFoundError:
+                pass
+    paths.sort()
+    for _, path in paths[:max(0, len(paths) - PROFILES_MAX_FILES)]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class _StackSampler(threading.Thread):
+    """
+    Periodically samples the call stack of one thread into collapsed form
+    """
+
+    def __init__(self, thread_id):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(PROFILE_SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(names))] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+@contextmanager
+def timed(phase):
+    """
+    Attribute the time spent in the block to a Server-Timing phase.
+    Does nothing unless the current request is being profiled.
+    """
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add_phase(phase, time.perf_counter() - start)
+
+
+def profiled(func):
+    """
+    Decorator for endpoint handlers: runs the handler under the profiler
+    when the current request has profiling enabled
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profile = _current_profile.get()
+        if profile is None:
+            return func(*args, **kwargs)
+        return profile.run(func, *args, **kwargs)
+    return wrapper
+
+
+def should_profile(headers):
+    """
+    Decide whether a request is profiled, from its raw ASGI headers
+    """
+    for name, value in headers:
+        if name == PROFILE_HEADER:
+            value = value.decode("latin-1").strip()
+            if PROFILE_TOKEN:
+                return value == PROFILE_TOKEN
+            return value.lower() not in ("", "0", "false", "no")
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def get_profile_path(filename):
+    """
+    Resolve a saved profile file, or None if it does not exist
+    """
+    if not re.fullmatch(r"[0-9a-f]{12}\.(prof|folded)", filename):
+        return None
+    file_path = os.path.join(PROFILES_DIR, filename)
+    if not os.path.exists(file_path):
+        return None
+    return file_path
+
+
+def list_profiles():
+    """
+    List saved profile files, newest first
+    """
+    if not os.path.isdir(PROFILES_DIR):
+        return []
+    files = [f for f in os.listdir(PROFILES_DIR) if get_profile_path(f)]
+    files.sort(key=lambda f: os.path.getmtime(os.path.join(PROFILES_DIR, f)), reverse=True)
+    return files
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware that enables profiling for selected requests and attaches
+    the Server-Timing breakdown to their responses
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not should_profile(scope["headers"]):
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope["path"])
+        token = _current_profile.set(profile)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", profile.server_timing().encode("latin-1")))
+                headers.append((b"x-profile-id", profile.id.encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current_profile.reset(token)
+            print(f"Profiled {profile.path} in {profile.finish() * 1000:.1f}ms (profile {profile.id})")
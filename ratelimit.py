@@ -0,0 +1,329 @@
+import os
+import math
+import time
+import sqlite3
+import hashlib
+import threading
+import contextlib
+import contextvars
+from collections import OrderedDict, namedtuple
+
+import metrics
+from fast_json import dumps
+from shared_store import store
+
+# Per-client token buckets: one for the number of requests and one for the
+# LLM tokens (prompt + completion, as counted by Ollama) a client may use.
+# Clients are identified by API key (X-API-Key or a Bearer token) or by IP.
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "1").lower() not in ("0", "false", "no")
+RATE_LIMIT_REQUESTS_PER_MINUTE = float(os.environ.get("RATE_LIMIT_REQUESTS_PER_MINUTE", "120"))
+RATE_LIMIT_REQUEST_BURST = float(os.environ.get("RATE_LIMIT_REQUEST_BURST", "60"))
+RATE_LIMIT_TOKENS_PER_MINUTE = float(os.environ.get("RATE_LIMIT_TOKENS_PER_MINUTE", "20000"))
+RATE_LIMIT_TOKEN_BURST = float(os.environ.get("RATE_LIMIT_TOKEN_BURST", "40000"))
+# Share the budgets between workers through the shared SQLite store.
+# Decisions are always made on in-memory buckets; with sharing on, a
+# background thread pushes each worker's usage to the store in batches and
+# pulls back the combined levels every RATE_LIMIT_SYNC_INTERVAL seconds.
+RATE_LIMIT_SHARED = os.environ.get("RATE_LIMIT_SHARED", "0").lower() in ("1", "true", "yes")
+RATE_LIMIT_SYNC_INTERVAL = float(os.environ.get("RATE_LIMIT_SYNC_INTERVAL", "1.0"))
+# Use the X-Forwarded-For address added by the reverse proxy when running
+# behind one. Only the last entry is trusted: earlier ones come from the client.
+RATE_LIMIT_TRUST_PROXY = os.environ.get("RATE_LIMIT_TRUST_PROXY", "0").lower() in ("1", "true", "yes")
+# In-memory buckets kept; the least recently seen clients are dropped first
+RATE_LIMIT_MAX_CLIENTS = int(os.environ.get("RATE_LIMIT_MAX_CLIENTS", "10000"))
+# Known API keys, comma-separated in API_KEYS and/or one per line in
+# API_KEYS_FILE. Requests with any other key are limited by IP, so clients
+# cannot get fresh budgets by making up keys.
+API_KEYS = os.environ.get("API_KEYS", "")
+API_KEYS_FILE = os.environ.get("API_KEYS_FILE", "")
+
+# Not counted: static assets, metrics, the CSS and live-highlighting edits
+# (one per keystroke in the editor)
+RATE_LIMIT_EXEMPT = ("/static/", "/metrics", "/highlight_code/css", "/highlight_code/live/")
+# Endpoints (method, path) that spend LLM tokens; refused while the client's
+# token budget is used up
+LLM_ENDPOINTS = {("POST", "/generate_code"), ("POST", "/prefetch")}
+
+# Client of the request being handled, for charging the LLM tokens it uses
+_current_client = contextvars.ContextVar("rate_limit_client", default=None)
+
+Decision = namedtuple("Decision", "allowed budget retry_after")
+
+
+class TokenBucket:
+    """
+    In-memory token bucket refilling at `rate` tokens per second
+    """
+
+    __slots__ = ("capacity", "rate", "level", "updated")
+
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, amount, allow_debt=False):
+        self._refill()
+        if not allow_debt and self.level < amount:
+            return False, self.level
+        self.level -= amount
+        return True, self.level
+
+    def peek(self):
+        self._refill()
+        return self.level
+
+
+class RateLimiter:
+    """
+    Request and LLM token budgets per client, kept in memory and optionally
+    synced across workers through the shared store
+    """
+
+    def __init__(self, request_burst=RATE_LIMIT_REQUEST_BURST, requests_per_minute=RATE_LIMIT_REQUESTS_PER_MINUTE,
+                 token_burst=RATE_LIMIT_TOKEN_BURST, tokens_per_minute=RATE_LIMIT_TOKENS_PER_MINUTE,
+                 shared=RATE_LIMIT_SHARED, max_clients=RATE_LIMIT_MAX_CLIENTS):
+        # budget name -> (capacity, refill per second)
+        self.budgets = {
+            "requests": (request_burst, requests_per_minute / 60.0),
+            "tokens": (token_burst, tokens_per_minute / 60.0)
+        }
+        self.shared = shared
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        # (client, budget) -> amount taken locally since the last sync
+        self._unsynced = {}
+        self._lock = threading.Lock()
+        self._syncer = None
+
+    def _bucket(self, client, budget):
+        key = (client, budget)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(*self.budgets[budget])
+            while len(self._buckets) > self.max_clients * 2:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def take(self, client, budget, amount, allow_debt=False):
+        """
+        Take from a client's budget; returns (taken, level afterwards)
+        """
+        with self._lock:
+            taken, level = self._bucket(client, budget).take(amount, allow_debt)
+            if taken and self.shared:
+                key = (client, budget)
+                self._unsynced[key] = self._unsynced.get(key, 0) + amount
+                if self._syncer is None:
+                    self._syncer = threading.Thread(target=self._sync_loop, name="ratelimit-sync", daemon=True)
+                    self._syncer.start()
+            return taken, level
+
+    def level(self, client, budget):
+        with self._lock:
+            return self._bucket(client, budget).peek()
+
+    def sync(self):
+        """
+        Add this worker's usage to the shared buckets and adopt the combined
+        levels, which include the other workers' usage
+        """
+        with self._lock:
+            unsynced, self._unsynced = self._unsynced, {}
+        if not unsynced:
+            return
+        amounts = {
+            f"ratelimit:{budget}:{client}": (amount, *self.budgets[budget])
+            for (client, budget), amount in unsynced.items()
+        }
+        try:
+            levels = store.drain_buckets(amounts)
+        except sqlite3.Error as e:
+            print(f"Shared rate limit sync failed: {str(e)}")
+            with self._lock:
+                for key, amount in unsynced.items():
+                    self._unsynced[key] = self._unsynced.get(key, 0) + amount
+            return
+        with self._lock:
+            for (client, budget) in unsynced:
+                bucket = self._buckets.get((client, budget))
+                if bucket is not None:
+                    # Usage since the snapshot is still pending for the next sync
+                    bucket.level = levels[f"ratelimit:{budget}:{client}"] - self._unsynced.get((client, budget), 0)
+                    bucket.updated = time.monotonic()
+
+    def _sync_loop(self):
+        while True:
+            time.sleep(RATE_LIMIT_SYNC_INTERVAL)
+            self.sync()
+
+    def retry_after(self, budget, level, amount):
+        """
+        Seconds until a bucket at `level` holds `amount` tokens
+        """
+        capacity, rate = self.budgets[budget]
+        return max(1, math.ceil((amount - level) / rate)) if rate > 0 else 3600
+
+    def check(self, client, uses_llm):
+        """
+        Count a request against the client's budgets
+        """
+        if uses_llm:
+            # Token usage is only known afterwards, so LLM requests are refused
+            # once earlier ones have used up the budget (level at or below 0)
+            level = self.level(client, "tokens")
+            if level <= 0:
+                return Decision(False, "tokens", self.retry_after("tokens", level, 1))
+        taken, level = self.take(client, "requests", 1)
+        if not taken:
+            return Decision(False, "requests", self.retry_after("requests", level, 1))
+        return Decision(True, None, 0)
+
+    def headers(self, client):
+        """
+        Rate-limit response headers with the client's remaining budgets
+        """
+        headers = []
+        for budget, prefix in (("requests", "x-ratelimit"), ("tokens", "x-ratelimit-tokens")):
+            capacity, rate = self.budgets[budget]
+            level = self.level(client, budget)
+            reset = math.ceil((capacity - level) / rate) if rate > 0 else 0
+            headers.append((f"{prefix}-limit".encode("latin-1"), str(int(capacity)).encode("latin-1")))
+            headers.append((f"{prefix}-remaining".encode("latin-1"), str(max(0, int(level))).encode("latin-1")))
+            headers.append((f"{prefix}-reset".encode("latin-1"), str(max(0, reset)).encode("latin-1")))
+        return headers
+
+
+rate_limiter = RateLimiter()
+
+
+def _hash_key(api_key):
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+def load_api_keys(keys=API_KEYS, path=API_KEYS_FILE):
+    """
+    Hashes of the configured API keys
+    """
+    configured = [k.strip() for k in keys.split(",")]
+    if path:
+        try:
+            with open(path, encoding="utf-8") as f:
+                configured.extend(line.strip() for line in f if not line.lstrip().startswith("#"))
+        except OSError as e:
+            print(f"Could not read API keys from {path}: {str(e)}")
+    return {_hash_key(k) for k in configured if k}
+
+
+_api_keys = load_api_keys()
+
+
+def client_key(scope):
+    """
+    Rate-limit key for a request: a hash of its API key if the key is
+    configured, else its IP
+    """
+    headers = dict(scope["headers"])
+    api_key = headers.get(b"x-api-key", b"").decode("latin-1").strip()
+    authorization = headers.get(b"authorization", b"").decode("latin-1").strip()
+    if not api_key and authorization.lower().startswith("bearer "):
+        api_key = authorization[7:].strip()
+    if api_key:
+        # Keys are hashed so they never end up in the shared store in clear
+        hashed = _hash_key(api_key)
+        if hashed in _api_keys:
+            return "key:" + hashed
+        metrics.incr("ratelimit.unknown_api_keys")
+
+    forwarded = headers.get(b"x-forwarded-for", b"").decode("latin-1")
+    if RATE_LIMIT_TRUST_PROXY and forwarded.strip():
+        return "ip:" + forwarded.split(",")[-1].strip()
+    client = scope.get("client")
+    return "ip:" + (client[0] if client else "unknown")
+
+
+def current_client():
+    """
+    Rate-limit key of the request being handled, or None outside a request
+    """
+    return _current_client.get()
+
+
+@contextlib.contextmanager
+def charging(client):
+    """
+    Charge the LLM tokens used inside the block to `client`. Background work
+    (prefetch, jobs) runs in its own threads, outside the request's context,
+    and uses this with the client recorded when the work was started.
+    """
+    token = _current_client.set(client)
+    try:
+        yield
+    finally:
+        _current_client.reset(token)
+
+
+def charge_llm_tokens(reply):
+    """
+    Charge the prompt and completion tokens of an Ollama reply to the current
+    client. Work started by no client (e.g. model warm-up) is not charged.
+    """
+    client = _current_client.get()
+    if client is None:
+        return
+    tokens = reply.get("prompt_eval_count", 0) + reply.get("eval_count", 0)
+    if tokens:
+        rate_limiter.take(client, "tokens", tokens, allow_debt=True)
+        metrics.incr("ratelimit.llm_tokens", tokens)
+
+
+class RateLimitMiddleware:
+    """
+    ASGI middleware enforcing the per-client budgets and adding the
+    X-RateLimit-* headers to responses
+    """
+
+    def __init__(self, app, limiter=None):
+        self.app = app
+        self.limiter = limiter or rate_limiter
+
+    async def __call__(self, scope, receive, send):
+        path = scope.get("path", "")
+        if (scope["type"] != "http" or not RATE_LIMIT_ENABLED or scope["method"] == "OPTIONS"
+                or path.startswith(RATE_LIMIT_EXEMPT)):
+            await self.app(scope, receive, send)
+            return
+
+        client = client_key(scope)
+        decision = self.limiter.check(client, (scope["method"], path) in LLM_ENDPOINTS)
+        if not decision.allowed:
+            metrics.incr(f"ratelimit.rejected.{decision.budget}")
+            message = "Too many requests" if decision.budget == "requests" else "LLM token quota exhausted"
+            body = dumps({"error": f"{message}, retry in {decision.retry_after}s", "retry_after": decision.retry_after})
+            headers = [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("latin-1")),
+                (b"retry-after", str(decision.retry_after).encode("latin-1"))
+            ]
+            await send({"type": "http.response.start", "status": 429,
+                        "headers": headers + self.limiter.headers(client)})
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                # Read when the response starts, so non-streaming LLM
+                # responses already include the tokens they used
+                message = {**message, "headers": list(message.get("headers", [])) + self.limiter.headers(client)}
+            await send(message)
+
+        with charging(client):
+            await self.app(scope, receive, send_with_headers)
@@ -0,0 +1,417 @@
+import os
+import re
+import json
+import zlib
+import hashlib
+import threading
+
+from startup import lazy_import
+
+# NumPy is loaded when the index is first used, not when the app starts
+np = lazy_import("numpy")
+
+# Local, CPU-only retrieval over trusted snippets. Texts are embedded with
+# feature hashing (no model download, no network), searched exactly by brute
+# force up to RETRIEVAL_BRUTE_FORCE_LIMIT vectors and with an inverted-file
+# (IVF) index above it.
+EMBEDDING_DIM = int(os.environ.get("RETRIEVAL_EMBEDDING_DIM", "256"))
+RETRIEVAL_BRUTE_FORCE_LIMIT = int(os.environ.get("RETRIEVAL_BRUTE_FORCE_LIMIT", "50000"))
+RETRIEVAL_NPROBE = int(os.environ.get("RETRIEVAL_NPROBE", "8"))
+RETRIEVAL_TOP_K = int(os.environ.get("RETRIEVAL_TOP_K", "3"))
+RETRIEVAL_MIN_SCORE = float(os.environ.get("RETRIEVAL_MIN_SCORE", "0.2"))
+RETRIEVAL_MAX_EXAMPLE_CHARS = 1500
+# Previous generations remembered for duplicate detection
+RETRIEVAL_MAX_GENERATIONS = int(os.environ.get("RETRIEVAL_MAX_GENERATIONS", "10000"))
+
+# Project files are indexed in chunks of this many lines
+PROJECT_CHUNK_LINES = 40
+PROJECT_MAX_FILE_BYTES = 256 * 1024
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Only projects under this directory can be indexed; indexed files are
+# returned by /retrieval/search, so this must not contain anything private
+PROJECT_ROOT = os.path.realpath(os.environ.get("RETRIEVAL_PROJECT_ROOT", os.path.join(BASE_DIR, "projects")))
+SHARED_CODE_DIR = os.path.join(BASE_DIR, "shared_code")
+PROMPTS_DIR = os.path.join(BASE_DIR, "prompts")
+
+EXTENSION_LANGUAGES = {
+    ".py": "python", ".js": "javascript", ".ts": "typescript", ".java": "java",
+    ".cpp": "cpp", ".cc": "cpp", ".h": "cpp", ".c": "c", ".cs": "csharp",
+    ".go": "go", ".rb": "ruby", ".php": "php", ".rs": "rust", ".html": "html",
+    ".css": "css", ".sql": "sql", ".sh": "bash"
+}
+
+_TOKEN_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|\d+")
+_SUBWORD_RE = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+")
+
+
+def _features(text):
+    """
+    Hashed features of a text: identifier subwords, whole tokens and bigrams
+    """
+    tokens = [t.lower() for t in _TOKEN_RE.findall(text)]
+    features = list(tokens)
+    for token in _TOKEN_RE.findall(text):
+        parts = _SUBWORD_RE.findall(token)
+        if len(parts) > 1:
+            features.extend(p.lower() for p in parts)
+    features.extend(a + " " + b for a, b in zip(tokens, tokens[1:]))
+    return features
+
+
+def embed_batch(texts):
+    """
+    Embed texts into L2-normalized float32 vectors, one row per text
+    """
+    rows, cols, signs = [], [], []
+    for row, text in enumerate(texts):
+        for feature in _features(text):
+            # crc32 rather than hash(), which is salted per process
+            h = zlib.crc32(feature.encode("utf-8"))
+            rows.append(row)
+            cols.append(h % EMBEDDING_DIM)
+            signs.append(1.0 if h & 0x80000000 else -1.0)
+
+    vectors = np.zeros((len(texts), EMBEDDING_DIM), dtype=np.float32)
+    if rows:
+        np.add.at(vectors, (np.array(rows), np.array(cols)), np.array(signs, dtype=np.float32))
+    # Sublinear term frequency, then cosine normalization
+    vectors = np.sign(vectors) * np.log1p(np.abs(vectors))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def content_hash(text):
+    """
+    Hash of a text with whitespace normalized, for exact-match lookups
+    """
+    normalized = " ".join(text.split())
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+def resolve_project_path(project_path, root=PROJECT_ROOT):
+    """
+    Real path of a project directory, relative paths being taken from the
+    project root. Raises PermissionError for anything outside the root and
+    ValueError if it is not a directory.
+    """
+    path = os.path.realpath(os.path.join(root, project_path))
+    if os.path.commonpath([root, path]) != root:
+        raise PermissionError("Project path is outside the allowed project root")
+    if not os.path.isdir(path):
+        raise ValueError("Invalid project path")
+    return path
+
+
+class VectorIndex:
+    """
+    Cosine-similarity index over normalized vectors. Exact below the brute
+    force limit; above it, vectors are clustered with k-means and only the
+    RETRIEVAL_NPROBE closest clusters (plus vectors added since the last
+    merge) are scanned.
+    """
+
+    # Vectors added since the last merge are scanned exhaustively; merge them
+    # into the main arrays once there are this many
+    PENDING_LIMIT = 8192
+
+    def __init__(self, dim=EMBEDDING_DIM, brute_force_limit=RETRIEVAL_BRUTE_FORCE_LIMIT, nprobe=RETRIEVAL_NPROBE):
+        self.dim = dim
+        self.brute_force_limit = brute_force_limit
+        self.nprobe = nprobe
+        self.items = []
+        # Indexed vectors (None until the first merge, so creating an index
+        # does not import NumPy); once clustered they are grouped by cluster
+        self._vectors = None
+        self._row_ids = None
+        self._assignments = None
+        self._pending = []
+        self._pending_ids = []
+        self._centroids = None
+        self._list_offsets = None
+        self._clustered_size = 0
+        self._merging = False
+        self._lock = threading.Lock()
+        self._merge_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, items, vectors):
+        with self._lock:
+            start = len(self.items)
+            self.items.extend(items)
+            self._pending.append(np.asarray(vectors, dtype=np.float32))
+            self._pending_ids.append(np.arange(start, start + len(items), dtype=np.int64))
+            if not self._merging and (
+                    sum(len(v) for v in self._pending) >= self.PENDING_LIMIT or len(self._pending) > 64):
+                # Merging (and k-means when re-clustering) takes seconds at
+                # scale, so it runs off the request path; pending vectors
+                # stay searchable until the merged arrays are swapped in
+                self._merging = True
+                threading.Thread(target=self._background_merge, name="retrieval-merge", daemon=True).start()
+
+    def _background_merge(self):
+        try:
+            self.merge()
+        except Exception as e:
+            print(f"Retrieval index merge failed: {str(e)}")
+        finally:
+            with self._lock:
+                self._merging = False
+
+    def merge(self):
+        """
+        Merge the pending vectors into the main arrays, re-clustering if
+        due. The work is done outside the lock; searches and adds carry on
+        meanwhile.
+        """
+        with self._merge_lock:
+            with self._lock:
+                count = len(self._pending)
+                if count == 0:
+                    return
+                new_vectors = np.concatenate(self._pending[:count])
+                new_ids = np.concatenate(self._pending_ids[:count])
+                old_vectors, old_row_ids = self._vectors, self._row_ids
+                old_assignments, centroids = self._assignments, self._centroids
+                clustered_size = self._clustered_size
+
+            if old_vectors is None:
+                vectors, row_ids = new_vectors, new_ids
+            else:
+                vectors = np.concatenate([old_vectors, new_vectors])
+                row_ids = np.concatenate([old_row_ids, new_ids])
+
+            assignments = offsets = None
+            if len(vectors) > self.brute_force_limit:
+                if centroids is None or len(vectors) > 2 * clustered_size:
+                    # (Re)cluster when the index first outgrows brute force or has doubled
+                    centroids = _kmeans(vectors, int(np.sqrt(len(vectors))))
+                    clustered_size = len(vectors)
+                    assignments = _assign(vectors, centroids)
+                else:
+                    assignments = np.concatenate([old_assignments, _assign(new_vectors, centroids)])
+                order = np.argsort(assignments, kind="stable")
+                vectors, row_ids, assignments = vectors[order], row_ids[order], assignments[order]
+                offsets = np.searchsorted(assignments, np.arange(len(centroids) + 1))
+            else:
+                centroids = None
+
+            with self._lock:
+                self._vectors, self._row_ids = vectors, row_ids
+                self._assignments, self._centroids, self._list_offsets = assignments, centroids, offsets
+                self._clustered_size = clustered_size
+                # Vectors added during the merge stay pending
+                del self._pending[:count]
+                del self._pending_ids[:count]
+
+    def search(self, query, k=RETRIEVAL_TOP_K):
+        """
+        Return [(score, item)] for the k most similar vectors
+        """
+        with self._lock:
+            vectors, row_ids = self._vectors, self._row_ids
+            centroids, offsets = self._centroids, self._list_offsets
+            pending = list(zip(self._pending, self._pending_ids))
+
+        scores, ids = [], []
+        if vectors is None:
+            pass
+        elif centroids is None:
+            scores.append(vectors @ query)
+            ids.append(row_ids)
+        else:
+            probe = np.argpartition(-(centroids @ query), min(self.nprobe, len(centroids) - 1))[:self.nprobe]
+            for cluster in probe:
+                start, end = offsets[cluster], offsets[cluster + 1]
+                scores.append(vectors[start:end] @ query)
+                ids.append(row_ids[start:end])
+        for pending_vectors, pending_ids in pending:
+            scores.append(pending_vectors @ query)
+            ids.append(pending_ids)
+
+        scores = np.concatenate(scores) if scores else np.zeros(0, dtype=np.float32)
+        ids = np.concatenate(ids) if ids else np.zeros(0, dtype=np.int64)
+        if len(scores) == 0:
+            return []
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), self.items[ids[i]]) for i in top]
+
+
+def _assign(vectors, centroids, chunk=65536):
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), chunk):
+        assignments[start:start + chunk] = np.argmax(vectors[start:start + chunk] @ centroids.T, axis=1)
+    return assignments
+
+
+def _kmeans(vectors, nlist, iterations=10, sample_size=50000, seed=0):
+    """
+    Spherical k-means on a sample of the vectors
+    """
+    rng = np.random.default_rng(seed)
+    sample = vectors[rng.choice(len(vectors), min(sample_size, len(vectors)), replace=False)]
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = _assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        # Empty clusters keep their previous centroid
+        empty = norms[:, 0] == 0
+        sums[empty] = centroids[empty]
+        norms[empty] = 1.0
+        centroids = sums / norms
+    return centroids
+
+
+class SnippetIndex:
+    """
+    Retrieval over shared snippets, saved templates, indexed project files
+    and previous generations. The index is in memory and per process: each
+    worker has its own, and nothing is persisted across restarts.
+    """
+
+    def __init__(self):
+        self.index = VectorIndex()
+        # content hash -> item, for serving exact repeats straight from the index
+        self._exact = {}
+        self._indexed_files = set()
+        # (source, language, content hash) of every indexed item, to skip duplicates
+        self._seen = set()
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            items = []
+            if os.path.isdir(SHARED_CODE_DIR):
+                for file_name in sorted(os.listdir(SHARED_CODE_DIR)):
+                    if file_name.endswith(".json"):
+                        try:
+                            with open(os.path.join(SHARED_CODE_DIR, file_name), "r", encoding="utf-8") as f:
+                                data = json.load(f)
+                            items.append({"source": "shared", "language": data.get("language", ""), "text": data["code"]})
+                        except (OSError, ValueError, KeyError) as e:
+                            print(f"Skipping shared snippet {file_name}: {str(e)}")
+            if os.path.isdir(PROMPTS_DIR):
+                for file_name in sorted(os.listdir(PROMPTS_DIR)):
+                    if file_name.endswith(".txt"):
+                        with open(os.path.join(PROMPTS_DIR, file_name), "r", encoding="utf-8") as f:
+                            items.append({"source": "template", "language": "", "text": f.read()})
+            self._add(items)
+            self._loaded = True
+
+    def _add(self, items):
+        unique = []
+        for item in items:
+            key = (item["source"], item["language"], content_hash(item["text"]))
+            if item["text"].strip() and key not in self._seen:
+                self._seen.add(key)
+                unique.append(item)
+        items = unique
+        if not items:
+            return
+        self.index.add(items, embed_batch([item["text"] for item in items]))
+
+    def add_snippet(self, code, language, source="shared"):
+        self._ensure_loaded()
+        self._add([{"source": source, "language": language, "text": code}])
+
+    def add_generation(self, mode, language, input_text, response):
+        """
+        Remember a generation so an identical request can be answered from
+        the index. Generations are only matched exactly, so they are not
+        embedded: in the vector index they would crowd out the snippets
+        used as examples.
+        """
+        self._ensure_loaded()
+        if len(self._exact) >= RETRIEVAL_MAX_GENERATIONS:
+            return
+        item = {"source": "generation", "mode": mode, "language": language, "text": input_text, "response": response}
+        self._exact[(mode, language, content_hash(input_text))] = item
+
+    def index_project(self, project_path):
+        """
+        Index a project's source files in fixed-size line chunks; the
+        project must be under PROJECT_ROOT
+        """
+        project_path = resolve_project_path(project_path)
+        self._ensure_loaded()
+        items = []
+        for root, dirs, files in os.walk(project_path):
+            dirs[:] = [d for d in dirs if not d.startswith('.') and d not in ("node_modules", "venv", "__pycache__")]
+            for file_name in files:
+                language = EXTENSION_LANGUAGES.get(os.path.splitext(file_name)[1].lower())
+                file_path = os.path.realpath(os.path.join(root, file_name))
+                if language is None or file_path in self._indexed_files:
+                    continue
+                if os.path.commonpath([PROJECT_ROOT, file_path]) != PROJECT_ROOT:
+                    # Symlink pointing out of the project root
+                    continue
+                if os.path.getsize(file_path) > PROJECT_MAX_FILE_BYTES:
+                    continue
+                try:
+                    with open(file_path, "r", encoding="utf-8") as f:
+                        lines = f.read().split("\n")
+                except (OSError, UnicodeDecodeError):
+                    continue
+                self._indexed_files.add(file_path)
+                rel_path = os.path.relpath(file_path, project_path)
+                for start in range(0, len(lines), PROJECT_CHUNK_LINES):
+                    items.append({
+                        "source": "project",
+                        "language": language,
+                        "path": rel_path,
+                        "text": "\n".join(lines[start:start + PROJECT_CHUNK_LINES])
+                    })
+        self._add(items)
+        return len(items)
+
+    def find_duplicate(self, mode, language, input_text):
+        """
+        Previous response for the same request, if any. Only exact repeats
+        (same mode and language, same text up to whitespace) match: similar
+        descriptions can differ in a word that changes the answer.
+        """
+        self._ensure_loaded()
+        item = self._exact.get((mode, language, content_hash(input_text)))
+        return item["response"] if item is not None else None
+
+    def search(self, query, language=None, k=RETRIEVAL_TOP_K, sources=("shared", "project", "template")):
+        """
+        Up to k relevant snippets from the given sources. Templates have no
+        language and match any language filter.
+        """
+        self._ensure_loaded()
+        if len(self.index) == 0:
+            return []
+        results = []
+        for score, item in self.index.search(embed_batch([query])[0], k=k * 4):
+            if score < RETRIEVAL_MIN_SCORE or len(results) == k:
+                break
+            if item["source"] in sources and (language is None or item["language"] in (language, "")):
+                results.append({"score": round(score, 4), **item})
+        return results
+
+    def examples(self, query, language, k=RETRIEVAL_TOP_K):
+        """
+        Snippet texts for few-shot prompting
+        """
+        results = self.search(query, language, k, sources=("shared", "project"))
+        return [result["text"][:RETRIEVAL_MAX_EXAMPLE_CHARS] for result in results]
+
+    def stats(self):
+        self._ensure_loaded()
+        return {"items": len(self.index), "exact_entries": len(self._exact)}
+
+
+snippet_index = SnippetIndex()
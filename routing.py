@@ -0,0 +1,131 @@
+import os
+from collections import namedtuple
+
+import llm
+import metrics
+from ratelimit import charge_llm_tokens
+from model_manager import model_manager
+from llm import MODEL_NAME, OLLAMA_KEEP_ALIVE, num_ctx_for
+
+# Model routing: which model and generation options serve a request,
+# depending on its mode and input size. Short debug fixes and explanations
+# of small snippets go to a small quantized model with tight output caps;
+# everything else goes to the regular (or a larger) model.
+SMALL_MODEL_NAME = os.environ.get("SMALL_MODEL_NAME", "codellama:7b-instruct-q4_0")
+LARGE_MODEL_NAME = os.environ.get("LARGE_MODEL_NAME", MODEL_NAME)
+ROUTING_POLICY = os.environ.get("ROUTING_POLICY", "adaptive")
+
+# Rough characters per token for code, used to size debug answers
+CHARS_PER_TOKEN = 3.5
+
+# One routing decision. `max_input` is the largest input (in characters) the
+# rule applies to; `brief` asks for a short answer instead of an essay.
+Route = namedtuple("Route", "name mode max_input model num_predict temperature keep_alive brief")
+
+POLICIES = {
+    # What every request used before routing: one model, Ollama's defaults
+    # (apart from the fixed num_ctx)
+    "default": [
+        Route("default", None, None, MODEL_NAME, None, None, None, False),
+    ],
+    "adaptive": [
+        Route("debug-small", "debug", 1500, SMALL_MODEL_NAME, 512, 0.2, "5m", False),
+        Route("debug", "debug", None, MODEL_NAME, 1024, 0.2, OLLAMA_KEEP_ALIVE, False),
+        Route("explain-brief", "explain", 400, SMALL_MODEL_NAME, 256, 0.3, "5m", True),
+        Route("explain", "explain", None, MODEL_NAME, 1024, 0.3, OLLAMA_KEEP_ALIVE, False),
+        Route("generate", "generate", 2000, MODEL_NAME, 1024, 0.4, OLLAMA_KEEP_ALIVE, False),
+        Route("generate-large", "generate", None, LARGE_MODEL_NAME, 2048, 0.4, OLLAMA_KEEP_ALIVE, False),
+    ],
+}
+
+
+def choose_route(mode, input_text, policy=None):
+    """
+    First route of the policy matching the mode and input size
+    """
+    for route in POLICIES[policy or ROUTING_POLICY]:
+        if route.mode not in (None, mode):
+            continue
+        if route.max_input is not None and len(input_text) > route.max_input:
+            continue
+        return route
+    return POLICIES["default"][0]
+
+
+def generation_options(route, prompt, context_tokens=0):
+    """
+    Ollama `options` for a request served by `route`. num_ctx is fixed per
+    model (see llm.num_ctx_for); a different value would reload the model.
+    """
+    num_ctx = num_ctx_for(route.model)
+    options = {"num_ctx": num_ctx}
+    if route.num_predict is not None:
+        num_predict = route.num_predict
+        if route.mode == "debug":
+            # A fix usually repeats the code, so a fixed cap would cut off
+            # large inputs: allow for the prompt's length on top, as far as
+            # the context window has room
+            prompt_tokens = len(prompt) / CHARS_PER_TOKEN
+            room = num_ctx - prompt_tokens - context_tokens
+            num_predict = int(max(num_predict, min(num_predict + prompt_tokens, room)))
+        options["num_predict"] = num_predict
+    if route.temperature is not None:
+        options["temperature"] = route.temperature
+    return options
+
+
+def session_route(mode, input_text, policy=None):
+    """
+    Route for a session turn. Ollama's context tokens only make sense to the
+    model that produced them, so sessions stay on the regular model.
+    """
+    for route in POLICIES[policy or ROUTING_POLICY]:
+        if route.mode not in (None, mode) or route.model != MODEL_NAME:
+            continue
+        if route.max_input is not None and len(input_text) > route.max_input:
+            continue
+        return route
+    return POLICIES["default"][0]
+
+
+# Models Ollama reported as missing; their routes fall back to MODEL_NAME
+_missing_models = set()
+
+
+def generate_routed(route, prompt, context=None, cancel_event=None, background=False, on_text=None):
+    """
+    Run a generation with the route's model and options. If the route's
+    model is not pulled on the Ollama server, the regular model is used.
+    Returns (Ollama's JSON reply, route actually used).
+    """
+    if route.model in _missing_models:
+        route = route._replace(model=MODEL_NAME)
+    elif route.model != MODEL_NAME and model_manager.should_avoid(route.model):
+        # Loading the route's model would push out a model in active use
+        metrics.incr(f"routing.{route.name}.cold_fallback")
+        route = route._replace(model=MODEL_NAME)
+    # Sessions keep the model loaded so the next turn can reuse the context
+    keep_alive = route.keep_alive or (OLLAMA_KEEP_ALIVE if context is not None else None)
+    options = generation_options(route, prompt, len(context or ()))
+    try:
+        reply = llm.generate(
+            prompt, model=route.model, context=context, keep_alive=keep_alive,
+            options=options, cancel_event=cancel_event, background=background, on_text=on_text
+        )
+    except llm.OllamaError as e:
+        if route.model == MODEL_NAME or "not found" not in str(e):
+            raise
+        print(f"Model {route.model} is not available, routing to {MODEL_NAME}")
+        _missing_models.add(route.model)
+        route = route._replace(model=MODEL_NAME)
+        options = generation_options(route, prompt, len(context or ()))
+        reply = llm.generate(
+            prompt, model=route.model, context=context, keep_alive=keep_alive,
+            options=options, cancel_event=cancel_event, background=background, on_text=on_text
+        )
+    charge_llm_tokens(reply)
+    model_manager.record_use(route.model, reply)
+    metrics.incr(f"routing.{route.name}.requests")
+    metrics.incr(f"routing.{route.name}.eval_tokens", reply.get("eval_count", 0))
+    metrics.incr(f"routing.{route.name}.prompt_tokens", reply.get("prompt_eval_count", 0))
+    return reply, route
@@ -0,0 +1,184 @@
+import os
+import time
+import uuid
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
+
+from shared_store import store
+
+# Bounds for the in-memory session table. The least recently used sessions
+# are evicted first once either limit is exceeded.
+SESSION_MAX_COUNT = int(os.environ.get("SESSION_MAX_COUNT", "500"))
+SESSION_MAX_BYTES = int(os.environ.get("SESSION_MAX_BYTES", str(64 * 1024 * 1024)))
+SESSION_IDLE_TTL = int(os.environ.get("SESSION_IDLE_TTL", "1800"))
+
+# Only the most recent turns are kept for display; the model sees the whole
+# conversation through the context tokens
+SESSION_MAX_TURNS = 20
+
+
+class StaleSession(Exception):
+    """
+    The session was saved by another request since it was loaded
+    """
+
+
+class ChatSession:
+    """
+    A conversation with the model, including Ollama's context tokens
+    """
+
+    def __init__(self, session_id, language, turns=None, context=None, created_at=None, version=0):
+        self.id = session_id
+        self.language = language
+        self.turns = turns or []
+        # Token ids as a compact int array rather than a list of Python ints
+        self.context = array("i", context or [])
+        self.created_at = created_at or time.time()
+        self.last_used = time.time()
+        # Version in the shared store this copy was loaded from or saved as
+        self.version = version
+
+    def copy(self):
+        return ChatSession(self.id, self.language, list(self.turns), self.context, self.created_at, self.version)
+
+    def add_turn(self, mode, input_text, response, context):
+        self.turns.append({"mode": mode, "input": input_text, "response": response})
+        del self.turns[:-SESSION_MAX_TURNS]
+        self.context = array("i", context or [])
+        self.last_used = time.time()
+
+    def size_bytes(self):
+        text = sum(len(t["input"]) + len(t["response"]) for t in self.turns)
+        return text + self.context.itemsize * len(self.context)
+
+    def to_dict(self, include_context=False):
+        data = {
+            "session_id": self.id,
+            "language": self.language,
+            "turns": self.turns,
+            "context_tokens": len(self.context),
+            "created_at": self.created_at
+        }
+        if include_context:
+            data["context"] = self.context.tolist()
+        return data
+
+
+class SessionStore:
+    """
+    Sessions live in the shared store, so any worker process can continue a
+    conversation; saves are rejected if another request saved the session
+    since it was loaded. A memory-bounded LRU keeps decoded sessions to
+    avoid reloading the ones whose version has not changed.
+    """
+
+    def __init__(self, max_count=SESSION_MAX_COUNT, max_bytes=SESSION_MAX_BYTES, idle_ttl=SESSION_IDLE_TTL):
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self._sessions = OrderedDict()
+        # Size of each session when it was last stored, since sessions are
+        # mutated in place between saves
+        self._sizes = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def create(self, language):
+        session = ChatSession(uuid.uuid4().hex, language)
+        self.save(session)
+        return session
+
+    def get(self, session_id):
+        """
+        The current version of a session, as a copy the caller may modify
+        and save; None if it does not exist or expired
+        """
+        try:
+            record = store.get_record("session", session_id, with_value=False)
+        except sqlite3.Error as e:
+            print(f"Error loading session {session_id}: {str(e)}")
+            return None
+        if record is None:
+            with self._lock:
+                self._remove(session_id)
+            return None
+
+        with self._lock:
+            cached = self._sessions.get(session_id)
+            if cached is not None and cached.version == record[0]:
+                cached.last_used = time.time()
+                self._sessions.move_to_end(session_id)
+                session = cached.copy()
+            else:
+                session = None
+
+        try:
+            if session is None:
+                # Saved by another worker (or not loaded here yet)
+                record = store.get_record("session", session_id)
+                if record is None:
+                    return None
+                version, data = record
+                session = ChatSession(
+                    data["session_id"], data["language"], data["turns"], data.get("context"),
+                    data["created_at"], version
+                )
+                self._put(session.copy())
+            # Idle expiry counts from the last use, not the last save
+            store.touch_record("session", session_id, self.idle_ttl)
+        except sqlite3.Error as e:
+            print(f"Error loading session {session_id}: {str(e)}")
+            return None
+        return session
+
+    def save(self, session):
+        """
+        Store a session loaded by get() (or created); raises StaleSession if
+        it was saved by another request in the meantime
+        """
+        try:
+            version = store.put_record(
+                "session", session.id, session.to_dict(include_context=True), session.version, ttl=self.idle_ttl
+            )
+        except sqlite3.Error as e:
+            print(f"Error saving session {session.id}: {str(e)}")
+            return
+        if version is None:
+            raise StaleSession(session.id)
+        session.version = version
+        self._put(session.copy())
+
+    def delete(self, session_id):
+        with self._lock:
+            self._remove(session_id)
+        store.delete_record("session", session_id)
+
+    def stats(self):
+        with self._lock:
+            return {"sessions": len(self._sessions), "bytes": self._bytes}
+
+    def _put(self, session):
+        with self._lock:
+            self._remove(session.id)
+            self._sessions[session.id] = session
+            self._sizes[session.id] = session.size_bytes()
+            self._bytes += self._sizes[session.id]
+            self._evict()
+
+    def _remove(self, session_id):
+        self._sessions.pop(session_id, None)
+        self._bytes -= self._sizes.pop(session_id, 0)
+
+    def _evict(self):
+        now = time.time()
+        for session_id in [s.id for s in self._sessions.values() if now - s.last_used > self.idle_ttl]:
+            self._remove(session_id)
+        while self._sessions and (len(self._sessions) > self.max_count or self._bytes > self.max_bytes):
+            oldest_id = next(iter(self._sessions))
+            self._remove(oldest_id)
+
+
+sessions = SessionStore()
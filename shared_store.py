@@ -0,0 +1,246 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import functools
+import threading
+
+# A single SQLite file (WAL mode) shared by every worker process, so caches
+# and counters stay warm and consistent when running with several workers.
+STORE_PATH = os.environ.get(
+    "SHARED_STORE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "shared_store.sqlite3")
+)
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", "20000"))
+CACHE_DEFAULT_TTL = int(os.environ.get("CACHE_DEFAULT_TTL", str(24 * 3600)))
+
+# Expired and excess entries are purged every this many writes
+_PURGE_EVERY = 500
+# Token buckets untouched for this long are dropped by purge()
+_BUCKET_IDLE_TTL = 24 * 3600
+
+
+class SharedStore:
+    """
+    Cross-process key/value cache and counters backed by SQLite
+    """
+
+    def __init__(self, path=STORE_PATH, max_entries=CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+
+    def _connection(self):
+        # One connection per thread and per process (workers may be forked)
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+            "expires_at REAL, created_at REAL NOT NULL, PRIMARY KEY (namespace, key))"
+        )
+        conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value REAL NOT NULL)")
+        # Versioned records (e.g. sessions): not subject to the cache's size limit
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS records ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, version INTEGER NOT NULL, value TEXT NOT NULL, "
+            "expires_at REAL, PRIMARY KEY (namespace, key))"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, level REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def get(self, namespace, key, default=None):
+        row = self._connection().execute(
+            "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?",
+            (namespace, key)
+        ).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return default
+        return json.loads(row[0])
+
+    def set(self, namespace, key, value, ttl=CACHE_DEFAULT_TTL):
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        self._connection().execute(
+            "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at, created_at) VALUES (?, ?, ?, ?, ?)",
+            (namespace, key, json.dumps(value), expires_at, now)
+        )
+        self._writes += 1
+        if self._writes % _PURGE_EVERY == 0:
+            self.purge()
+
+    def delete(self, namespace, key):
+        self._connection().execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def purge(self):
+        """
+        Drop expired entries and the oldest entries beyond max_entries
+        """
+        conn = self._connection()
+        conn.execute("DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at < ?", (time.time(),))
+        conn.execute(
+            "DELETE FROM cache WHERE rowid IN ("
+            "SELECT rowid FROM cache ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+        conn.execute("DELETE FROM records WHERE expires_at IS NOT NULL AND expires_at < ?", (time.time(),))
+        # Buckets idle this long have refilled; a missing bucket counts as full
+        conn.execute("DELETE FROM buckets WHERE updated < ?", (time.time() - _BUCKET_IDLE_TTL,))
+
+    def get_record(self, namespace, key, with_value=True):
+        """
+        (version, value) of a versioned record, or None if it is missing or
+        expired; value is None when with_value is False
+        """
+        row = self._connection().execute(
+            f"SELECT version, {'value' if with_value else 'NULL'}, expires_at FROM records "
+            "WHERE namespace = ? AND key = ?",
+            (namespace, key)
+        ).fetchone()
+        if row is None or (row[2] is not None and row[2] < time.time()):
+            return None
+        return row[0], json.loads(row[1]) if with_value else None
+
+    def put_record(self, namespace, key, value, version, ttl=None):
+        """
+        Write a record only if its stored version is still `version` (0 for a
+        new record). Returns the new version, or None if another writer got
+        there first.
+        """
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        conn = self._connection()
+        if version == 0:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO records (namespace, key, version, value, expires_at) VALUES (?, ?, 1, ?, ?)",
+                (namespace, key, json.dumps(value), expires_at)
+            )
+        else:
+            cursor = conn.execute(
+                "UPDATE records SET value = ?, version = version + 1, expires_at = ? "
+                "WHERE namespace = ? AND key = ? AND version = ? AND (expires_at IS NULL OR expires_at >= ?)",
+                (json.dumps(value), expires_at, namespace, key, version, now)
+            )
+        return version + 1 if cursor.rowcount == 1 else None
+
+    def touch_record(self, namespace, key, ttl):
+        """
+        Push back a record's expiry without changing its version
+        """
+        self._connection().execute(
+            "UPDATE records SET expires_at = ? WHERE namespace = ? AND key = ?",
+            (time.time() + ttl, namespace, key)
+        )
+
+    def delete_record(self, namespace, key):
+        self._connection().execute("DELETE FROM records WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def acquire_lease(self, name, owner, ttl):
+        """
+        Take or renew the named lease for `owner` unless another owner holds
+        an unexpired one; returns whether `owner` holds it now
+        """
+        now = time.time()
+        row = self._connection().execute(
+            "INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+            "WHERE leases.owner = excluded.owner OR leases.expires_at < ? RETURNING owner",
+            (name, owner, now + ttl, now)
+        ).fetchone()
+        return row is not None
+
+    def incr(self, name, amount=1):
+        row = self._connection().execute(
+            "INSERT INTO counters (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value RETURNING value",
+            (name, amount)
+        ).fetchone()
+        return row[0]
+
+    def set_value(self, name, value):
+        self._connection().execute(
+            "INSERT OR REPLACE INTO counters (name, value) VALUES (?, ?)", (name, value)
+        )
+
+    def drain_buckets(self, amounts):
+        """
+        Take amounts from token buckets in one transaction. `amounts` maps a
+        bucket name to (amount, capacity, refill rate per second); levels may
+        go negative. Returns {name: level afterwards}.
+        """
+        conn = self._connection()
+        levels = {}
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            for name, (amount, capacity, rate) in amounts.items():
+                row = conn.execute("SELECT level, updated FROM buckets WHERE name = ?", (name,)).fetchone()
+                level = capacity if row is None else min(capacity, row[0] + max(0.0, now - row[1]) * rate)
+                levels[name] = level - amount
+                conn.execute(
+                    "INSERT OR REPLACE INTO buckets (name, level, updated) VALUES (?, ?, ?)",
+                    (name, levels[name], now)
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return levels
+
+    def counters(self, prefix=""):
+        rows = self._connection().execute(
+            "SELECT name, value FROM counters WHERE name LIKE ? ORDER BY name", (prefix + "%",)
+        ).fetchall()
+        return {name: int(value) if float(value).is_integer() else value for name, value in rows}
+
+
+store = SharedStore()
+
+
+def cache_key(*parts):
+    """
+    Build a stable cache key from JSON-serializable parts
+    """
+    raw = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def memoize(namespace, ttl=CACHE_DEFAULT_TTL):
+    """
+    Decorator caching a function's JSON-serializable result in the shared store
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = cache_key(args, kwargs)
+            try:
+                cached = store.get(namespace, key)
+            except sqlite3.Error as e:
+                print(f"Shared cache read failed ({namespace}): {str(e)}")
+                return func(*args, **kwargs)
+            if cached is not None:
+                return cached
+
+            result = func(*args, **kwargs)
+            try:
+                store.set(namespace, key, result, ttl)
+            except sqlite3.Error as e:
+                print(f"Shared cache write failed ({namespace}): {str(e)}")
+            return result
+        return wrapper
+    return decorator
@@ -0,0 +1,125 @@
+import os
+import sys
+import time
+import threading
+import importlib
+
+import metrics
+
+# Imported first by app.py, so this is (nearly) when the app module started loading
+IMPORT_STARTED = time.perf_counter()
+
+# Directories the app writes to or serves; created at startup rather than
+# assumed to exist in the image
+RUNTIME_DIRS = ("generated", "shared_code", "cache")
+
+# Languages whose lexers are loaded ahead of the first highlight request
+PREWARM_LANGUAGES = (
+    "python", "javascript", "typescript", "java", "csharp", "cpp", "go",
+    "rust", "php", "ruby", "html", "css", "sql", "bash"
+)
+PREWARM_ENABLED = os.environ.get("PREWARM_ENABLED", "1") == "1"
+
+_timings = {}
+
+
+class _LazyModule:
+    """
+    Stand-in for a module that imports it on first attribute access. The
+    import goes through importlib's per-module lock, so threads touching the
+    module for the first time at once all get the fully loaded module
+    (importlib's LazyLoader is not thread-safe on Python 3.11).
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        module = self._module
+        if module is None:
+            module = self._module = importlib.import_module(self._name)
+        return getattr(module, attr)
+
+
+def lazy_import(name):
+    """
+    Module object for `name` whose code only runs on first attribute access
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    return _LazyModule(name)
+
+
+def ensure_runtime_dirs(base_dir="."):
+    for name in RUNTIME_DIRS:
+        os.makedirs(os.path.join(base_dir, name), exist_ok=True)
+
+
+def _process_age():
+    # Seconds since the process started (Linux only), which also covers the
+    # interpreter and uvicorn start-up before app.py is imported
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def mark(name):
+    """
+    Record how long after the start of the app import `name` happened
+    """
+    _timings[name] = round(time.perf_counter() - IMPORT_STARTED, 4)
+
+
+def startup_timings():
+    return dict(_timings)
+
+
+def _prewarm():
+    # Imports and caches the first requests would otherwise pay for
+    import utils
+    from pygments.lexers import get_lexer_by_name
+    from retrieval import snippet_index
+
+    started = time.perf_counter()
+    for language in PREWARM_LANGUAGES:
+        try:
+            get_lexer_by_name(language)
+        except Exception as e:
+            print(f"Prewarm: no lexer for {language}: {str(e)}")
+    utils.get_highlight_css()
+    # First attribute access runs the deferred import
+    lazy_import("requests").Session
+    # Loads shared snippets and prompt templates into the retrieval index
+    snippet_index.stats()
+
+    _timings["prewarm_seconds"] = round(time.perf_counter() - started, 4)
+    mark("prewarmed")
+    metrics.set_gauge("startup.prewarm_seconds", _timings["prewarm_seconds"])
+    print(f"Prewarm finished in {_timings['prewarm_seconds']:.2f}s")
+
+
+def on_ready():
+    """
+    Called once the app is about to accept requests: report the startup time
+    and warm caches in the background so the port opens without waiting
+    """
+    mark("ready")
+    age = _process_age()
+    if age is not None:
+        _timings["process_seconds"] = round(age, 4)
+        metrics.set_gauge("startup.process_seconds", _timings["process_seconds"])
+    metrics.set_gauge("startup.import_seconds", _timings.get("imported", 0))
+    metrics.set_gauge("startup.ready_seconds", _timings["ready"])
+    print(
+        f"Startup: app imported in {_timings.get('imported', 0):.2f}s, ready after {_timings['ready']:.2f}s"
+        + (f" ({age:.2f}s since process start)" if age is not None else "")
+    )
+
+    if PREWARM_ENABLED:
+        threading.Thread(target=_prewarm, name="prewarm", daemon=True).start()
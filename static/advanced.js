@@ -92,8 +92,46 @@ document.addEventListener('DOMContentLoaded', function() {
     // Initialize placeholder
     updatePlaceholder();
   }
+  
+  // Prefetch explanations for pasted code
+  if (document.getElementById('code-input')) {
+    const codeInput = document.getElementById('code-input');
+    codeInput.addEventListener('paste', function() {
+      // Wait for the pasted text to land in the textarea
+      setTimeout(startPrefetch, 0);
+    });
+    codeInput.addEventListener('input', function(event) {
+      if (event.inputType !== 'insertFromPaste') {
+        cancelPrefetch();
+      }
+    });
+  }
 });
 
+// Speculative prefetch: the server starts explaining pasted code at low
+// priority so Explain/Analyze answer instantly when the user clicks
+const prefetchClientId = 'client-' + Math.random().toString(36).slice(2);
+let prefetchPending = false;
+
+function startPrefetch() {
+  const code = document.getElementById('code-input').value.trim();
+  const mode = document.getElementById('mode').value;
+  if (!code || (mode !== 'explain' && mode !== 'analyze')) return;
+  
+  const formData = new FormData();
+  formData.append('code', code);
+  formData.append('language', document.getElementById('language') ? document.getElementById('language').value : 'python');
+  formData.append('client_id', prefetchClientId);
+  prefetchPending = true;
+  fetch('/prefetch', { method: 'POST', body: formData }).catch(() => {});
+}
+
+function cancelPrefetch() {
+  if (!prefetchPending) return;
+  prefetchPending = false;
+  fetch('/prefetch/' + prefetchClientId, { method: 'DELETE' }).catch(() => {});
+}
+
 function updatePlaceholder() {
   const mode = document.getElementById('mode').value;
   const input = document.getElementById('code-input');
@@ -234,7 +272,7 @@ async function processRequest() {
       case 'generate':
       case 'debug':
       case 'explain':
-        resultContent = formatCode(data.code);
+        resultContent = data.blocks && data.blocks.length ? formatReply(data) : formatCode(data.code);
         break;
       case 'analyze':
         resultContent = formatAnalysisResult(data);
@@ -264,6 +302,40 @@ async function processRequest() {
 }
 
 // Format functions for different response types
+
+// Load the highlighting stylesheet once, for pre-highlighted code blocks
+function ensureHighlightCss() {
+  if (document.getElementById('highlight-css')) return;
+  const link = document.createElement('link');
+  link.id = 'highlight-css';
+  link.rel = 'stylesheet';
+  link.href = '/highlight_code/css';
+  document.head.appendChild(link);
+}
+
+// Reply text with its code blocks already highlighted and checked by the server
+function formatReply(data) {
+  ensureHighlightCss();
+  let html = '';
+  let position = 0;
+  for (const block of data.blocks) {
+    const text = data.code.slice(position, block.start).trim();
+    if (text) {
+      html += `<div class="whitespace-pre-wrap mb-2">${escapeHtml(text)}</div>`;
+    }
+    if (block.valid === false && block.error) {
+      html += `<div class="text-sm mb-1" style="color: #e53e3e;">Syntax error${block.error.line ? ' on line ' + block.error.line : ''}: ${escapeHtml(block.error.message)}</div>`;
+    }
+    html += block.html ? `<div class="overflow-x-auto mb-2">${block.html}</div>` : formatCode(block.code);
+    position = block.end;
+  }
+  const rest = data.code.slice(position).trim();
+  if (rest) {
+    html += `<div class="whitespace-pre-wrap">${escapeHtml(rest)}</div>`;
+  }
+  return html;
+}
+
 function formatAnalysisResult(analysis) {
   let html = '<div class="space-y-4">';
   
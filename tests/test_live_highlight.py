@@ -0,0 +1,71 @@
+import random
+import threading
+
+import pytest
+
+from live_highlight import DocumentOutOfSync, LiveDocument, LiveDocumentStore
+
+# Lines that open and close multi-line constructs (docstrings, block
+# comments, raw strings, heredocs), so random edits keep changing how much
+# of the document they cover
+SNIPPETS = {
+    "python": ['def f(x):', '    return x + 1', '"""Docs', 'end"""', "x = '''", "'''", 's = "abc', '# c', ''],
+    "javascript": ['function f(x) {', '  return x + 1;', '}', '/* start', 'end */', 'let s = `tpl', '${x}`', '// c'],
+    "java": ['class A {', '  int x = 1;', '}', '/* c', '*/', 'String t = """', '"""', '// x'],
+    "go": ['func f() {', '}', '/* c', '*/', 's := `raw', 'end`', 'x := 1'],
+    "css": ['a {', '}', 'color: red;', '/* c', '*/', '@media x {'],
+    "bash": ['echo hi', "x='a", "b'", 'cat <<EOF', 'EOF', '# c', 'if x; then', 'fi'],
+    "html": ['<div>', '</div>', '<!-- c', '-->', '<script>', 'var x = 1;', '</script>'],
+}
+
+
+def test_docstring_closed_lines_later():
+    doc = LiveDocument("d", "python", "x = 1\ny = 2\nz = 3\nw = 4")
+    doc.apply_edit(1, 2, '"""Docs')
+    doc.apply_edit(3, 4, 'end"""')
+    assert doc.html == LiveDocument("r", "python", "\n".join(doc.lines)).html
+
+
+@pytest.mark.parametrize("language", sorted(SNIPPETS))
+def test_random_edits_match_full_lexing(language):
+    rng = random.Random(language)
+    snippets = SNIPPETS[language]
+    for _ in range(10):
+        doc = LiveDocument("d", language, "\n".join(rng.choice(snippets) for _ in range(rng.randint(1, 80))))
+        for _ in range(15):
+            start = rng.randint(0, len(doc.lines))
+            end = rng.randint(start, min(len(doc.lines), start + 3))
+            text = "\n".join(rng.choice(snippets) for _ in range(rng.randint(1, 3)))
+            doc.apply_edit(start, end, text)
+            full = LiveDocument("r", language, "\n".join(doc.lines))
+            assert doc.html == full.html, (start, end, text)
+            assert doc.states == full.states
+
+
+def test_concurrent_edits_with_same_base_hash_apply_once():
+    store = LiveDocumentStore()
+    base_hash = store.open("d", "python", "x = 1").hash
+    results = []
+
+    def edit():
+        try:
+            store.edit("d", base_hash, 1, 1, "y = 2")
+            results.append("applied")
+        except DocumentOutOfSync:
+            results.append("resync")
+
+    threads = [threading.Thread(target=edit) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results.count("applied") == 1
+    assert store._documents["d"].lines == ["x = 1", "y = 2"]
+
+
+def test_edit_over_size_cap_is_rejected():
+    store = LiveDocumentStore(max_chars=100)
+    document = store.open("d", "python", "x = 1")
+    with pytest.raises(ValueError):
+        store.edit("d", document.hash, 0, 1, "x" * 200)
+    assert document.lines == ["x = 1"]
@@ -0,0 +1,68 @@
+import os
+import tempfile
+
+# Keep the test's metrics out of the app's shared store
+os.environ.setdefault("SHARED_STORE_PATH", os.path.join(tempfile.mkdtemp(), "shared_store.sqlite3"))
+
+from model_manager import ModelManager, StubBackend
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def serve(manager, backend, model):
+    # What a routed request does: Ollama loads the model if needed, then the
+    # reply's load_duration is reported to the manager
+    seconds = backend.load(model, manager.keep_alive)
+    manager.record_use(model, {"load_duration": seconds * 1e9})
+
+
+def test_preload_keep_warm_and_idle_out():
+    clock = FakeClock()
+    backend = StubBackend(capacity=2, load_seconds=2.0, clock=clock)
+    manager = ModelManager(backend=backend, preload=["a"], max_resident=2, keep_alive="10m", clock=clock)
+
+    manager.preload_models()
+    assert backend.loads == ["a:latest"]
+
+    clock.now = 1010
+    serve(manager, backend, "b")
+    assert backend.loads == ["a:latest", "b:latest"]
+    assert manager.status()["models"]["b:latest"]["loads"] == 1
+
+    # Both slots hold a model used within MODEL_MIN_RESIDENCY
+    clock.now = 1020
+    assert manager.should_avoid("c")
+    assert not manager.should_avoid("a")
+
+    # "a" has been idle longer than MODEL_MIN_RESIDENCY, so "c" may take its slot
+    clock.now = 1400
+    serve(manager, backend, "b")
+    assert not manager.should_avoid("c")
+
+    # Ollama idled "a" out after its 10m keep_alive; it is still recent
+    # enough to be reloaded, and "b" gets a keep-alive ping instead of a load
+    clock.now = 1700
+    manager.tick()
+    assert backend.loads == ["a:latest", "b:latest", "a:latest"]
+    assert set(backend.resident()) == {"a:latest", "b:latest"}
+
+    # Past MODEL_IDLE_TIMEOUT nothing is reloaded
+    clock.now = 4000
+    manager.tick()
+    assert backend.loads == ["a:latest", "b:latest", "a:latest"]
+    assert backend.resident() == {}
+
+
+def test_preload_only_fills_free_slots():
+    clock = FakeClock()
+    backend = StubBackend(capacity=1, load_seconds=2.0, clock=clock)
+    manager = ModelManager(backend=backend, preload=["a", "b"], max_resident=1, keep_alive="10m", clock=clock)
+
+    manager.preload_models()
+    assert backend.loads == ["a:latest"]
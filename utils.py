@@ -1,54 +1,35 @@
 import os
 import json
 import uuid
-import zipfile
-from io import BytesIO
 import re
-from pygments import highlight
-from pygments.lexers import get_lexer_by_name
-from pygments.formatters import HtmlFormatter
+import functools
+
+from analyzers import get_analyzer, tokenize
+from profiling import timed
+from shared_store import memoize
 
 # Code Analysis Functions
+# Per-language rules live in analyzers.py; these functions keep the
+# response shapes the endpoints return
+@memoize("analysis")
 def analyze_code_structure(code, language="python"):
     """
     Analyze code structure and return insights
     """
+    analyzer = get_analyzer(language)
+    structure = analyzer.structure(code, language)
+    complexity = analyzer.complexity(code, language)
     analysis = {
-        "complexity": 0,
+        "complexity": complexity,
         "suggestions": [],
-        "structure": {}
+        "structure": structure
     }
     
-    # Simple complexity analysis
-    if language == "python":
-        # Count indentation levels as a simple complexity metric
-        lines = code.split('\n')
-        max_indent = 0
-        for line in lines:
-            if line.strip() and not line.strip().startswith('#'):
-                indent = len(line) - len(line.lstrip())
-                max_indent = max(max_indent, indent // 4)
-        
-        analysis["complexity"] = max_indent
-        
-        # Basic structure analysis for Python
-        functions = re.findall(r'def\s+([a-zA-Z_][a-zA-Z0-9_]*)\s*\(', code)
-        classes = re.findall(r'class\s+([a-zA-Z_][a-zA-Z0-9_]*)\s*[:\(]', code)
-        imports = re.findall(r'import\s+([a-zA-Z_][a-zA-Z0-9_]*)', code)
-        imports.extend(re.findall(r'from\s+([a-zA-Z_][a-zA-Z0-9_.]*)\s+import', code))
-        
-        analysis["structure"] = {
-            "functions": functions,
-            "classes": classes,
-            "imports": imports,
-            "loc": len(lines)
-        }
-        
-        # Simple suggestions
-        if max_indent > 4:
-            analysis["suggestions"].append("Consider refactoring deeply nested code for better readability")
-        if len(functions) > 10:
-            analysis["suggestions"].append("Consider splitting into multiple modules for better organization")
+    # Simple suggestions
+    if complexity > 4:
+        analysis["suggestions"].append("Consider refactoring deeply nested code for better readability")
+    if len(structure["functions"]) > 10:
+        analysis["suggestions"].append("Consider splitting into multiple modules for better organization")
     
     return analysis
 
@@ -56,109 +37,74 @@ def generate_unit_tests(code, language="python"):
     """
     Generate basic unit tests for the given code
     """
-    if language == "python":
-        # Extract function definitions
-        functions = re.findall(r'def\s+([a-zA-Z_][a-zA-Z0-9_]*)\s*\((.*?)\):', code, re.DOTALL)
-        
-        tests = []
-        for func_name, params in functions:
-            # Skip if it looks like a private method or special method
-            if func_name.startswith('_'):
-                continue
-                
-            # Create a basic test for this function
-            param_list = params.split(',')
-            clean_params = []
-            for p in param_list:
-                p = p.strip()
-                if p and not p.startswith('self'):
-                    clean_params.append(p.split(':')[0].split('=')[0].strip())
-            
-            test_code = f"""
-def test_{func_name}():
-    # Arrange
-    {"# TODO: Set up test parameters" if clean_params else "pass"}
-    {f"# Parameters: {', '.join(clean_params)}" if clean_params else ""}
-    
-    # Act
-    result = {func_name}({", ".join(["None" for _ in clean_params])})
-    
-    # Assert
-    assert result is not None  # Replace with actual assertion
-"""
-            tests.append(test_code)
-        
-        if tests:
-            full_test_code = "import pytest\n\n" + "\n".join(tests)
-            return full_test_code
-        else:
-            return "# No testable functions found in the provided code"
-    
-    return "# Test generation not supported for this language yet"
+    tests = get_analyzer(language).unit_tests(code, language)
+    if tests is None:
+        return "# Test generation not supported for this language yet"
+    return tests
 
+@memoize("security")
 def check_security_issues(code, language="python"):
     """
     Basic security check for common issues in code
     """
-    issues = []
-    
-    if language == "python":
-        # Check for potential SQL injection
-        if re.search(r'execute\s*\(\s*[\'"][^\']*\%s[^\']*[\'"]\s*%\s*', code):
-            issues.append({
-                "type": "SQL Injection",
-                "severity": "High",
-                "description": "Possible SQL injection vulnerability detected. Use parameterized queries instead."
-            })
-        
-        # Check for hardcoded credentials
-        if re.search(r'password\s*=\s*[\'"][^\'"]+[\'"]\s*', code, re.IGNORECASE):
-            issues.append({
-                "type": "Hardcoded Credentials",
-                "severity": "High",
-                "description": "Hardcoded password detected. Use environment variables or a secure vault instead."
-            })
-        
-        # Check for use of eval
-        if re.search(r'eval\s*\(', code):
-            issues.append({
-                "type": "Code Injection",
-                "severity": "High",
-                "description": "Use of eval() detected, which can lead to code injection vulnerabilities."
-            })
-        
-        # Check for pickle usage (potential deserialization issues)
-        if re.search(r'import\s+pickle|from\s+pickle\s+import', code):
-            issues.append({
-                "type": "Unsafe Deserialization",
-                "severity": "Medium",
-                "description": "Use of pickle module detected. Be cautious with untrusted data."
-            })
-    
-    return issues
+    return get_analyzer(language).security_issues(code, language)
+
+HIGHLIGHT_LANGUAGE_MAP = {
+    "js": "javascript",
+    "py": "python",
+    "cs": "csharp",
+    "ts": "typescript",
+    "c++": "cpp",
+    "html+css": "html",
+    "html+js": "html"
+}
+
+def normalize_highlight_language(language):
+    # Clean up language string to ensure compatibility with Pygments
+    language = language.lower().strip()
+    return HIGHLIGHT_LANGUAGE_MAP.get(language, language)
 
 def format_code_with_highlighting(code, language="python"):
     """
     Format code with syntax highlighting using Pygments
     """
     try:
-        # Get the appropriate lexer for the language
-        try:
-            lexer = get_lexer_by_name(language, stripall=True)
-        except Exception as lexer_error:
-            print(f"Lexer error for language '{language}': {str(lexer_error)}")
-            # Fallback to python if language not found
-            lexer = get_lexer_by_name("python", stripall=True)
+        result = _highlight_html(code, language)
+        css = get_highlight_css()
         
-        # Use monokai style for better visibility
-        formatter = HtmlFormatter(style="monokai", linenos=True, cssclass="source")
-        result = highlight(code, lexer, formatter)
-        
-        # Get CSS for the highlighting
-        css = HtmlFormatter(style="monokai").get_style_defs('.source')
-        
-        # Add some additional CSS to improve display
-        css += """
+        return {"html": result, "css": css}
+    except Exception as e:
+        print(f"Error highlighting code: {str(e)}")
+        # Fallback to simple pre tag if highlighting fails
+        return {"html": f"<pre>{code}</pre>", "css": ""}
+
+@memoize("highlight")
+def _highlight_html(code, language):
+    """
+    Highlighted HTML for the code, shared across workers via the cache
+    """
+    # Pygments is imported on first use to keep the app's start-up fast
+    from pygments import format as format_tokens
+    from pygments.formatters import HtmlFormatter
+
+    # Use monokai style for better visibility
+    formatter = HtmlFormatter(style="monokai", linenos=True, cssclass="source")
+    # The tokens are shared with the analysis and security scan of this code
+    tokens = tokenize(code, language)
+    with timed("format"):
+        return format_tokens(tokens, formatter)
+
+@functools.lru_cache(maxsize=None)
+def get_highlight_css():
+    """
+    CSS for highlighted code; identical for every call, so built once
+    """
+    from pygments.formatters import HtmlFormatter
+
+    css = HtmlFormatter(style="monokai").get_style_defs('.source')
+    
+    # Add some additional CSS to improve display
+    css += """
         .source {
             background-color: #272822;
             padding: 0.5em;
@@ -173,12 +119,7 @@ def format_code_with_highlighting(code, language="python"):
             text-align: right;
         }
         """
-        
-        return {"html": result, "css": css}
-    except Exception as e:
-        print(f"Error highlighting code: {str(e)}")
-        # Fallback to simple pre tag if highlighting fails
-        return {"html": f"<pre>{code}</pre>", "css": ""}
+    return css
 
 def break_down_task(task_description):
     """
@@ -244,8 +185,9 @@ def store_shared_code(share_id, code, language="python"):
         "created_at": str(uuid.uuid1())  # Use timestamp-based UUID for creation time
     }
     
-    with open(os.path.join(shared_dir, f"{share_id}.json"), "w", encoding="utf-8") as f:
-        json.dump(data, f)
+    with timed("disk"):
+        with open(os.path.join(shared_dir, f"{share_id}.json"), "w", encoding="utf-8") as f:
+            json.dump(data, f)
     
     return True
 
@@ -259,8 +201,9 @@ def get_shared_code(share_id):
     if not os.path.exists(file_path):
         return None
     
-    with open(file_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
+    with timed("disk"):
+        with open(file_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
     
     return data
 
@@ -278,8 +221,9 @@ def save_user_template(template_name, template_content):
     
     file_path = os.path.join(prompts_dir, safe_name)
     
-    with open(file_path, "w", encoding="utf-8") as f:
-        f.write(template_content)
+    with timed("disk"):
+        with open(file_path, "w", encoding="utf-8") as f:
+            f.write(template_content)
     
     return file_path
 
@@ -293,26 +237,27 @@ def analyze_project_structure(project_path):
     structure = {"directories": [], "files": [], "summary": {}}
     file_types = {}
     
-    for root, dirs, files in os.walk(project_path):
-        # Skip hidden directories and files
-        dirs[:] = [d for d in dirs if not d.startswith('.')]
-        
-        rel_path = os.path.relpath(root, project_path)
-        if rel_path == '.':
-            rel_path = ''
-        
-        for dir_name in dirs:
-            structure["directories"].append(os.path.join(rel_path, dir_name))
-        
-        for file_name in files:
-            if not file_name.startswith('.'):
-                file_path = os.path.join(rel_path, file_name)
-                structure["files"].append(file_path)
-                
-                # Count file types
-                ext = os.path.splitext(file_name)[1].lower()
-                if ext:
-                    file_types[ext] = file_types.get(ext, 0) + 1
+    with timed("disk"):
+        for root, dirs, files in os.walk(project_path):
+            # Skip hidden directories and files
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            
+            rel_path = os.path.relpath(root, project_path)
+            if rel_path == '.':
+                rel_path = ''
+            
+            for dir_name in dirs:
+                structure["directories"].append(os.path.join(rel_path, dir_name))
+            
+            for file_name in files:
+                if not file_name.startswith('.'):
+                    file_path = os.path.join(rel_path, file_name)
+                    structure["files"].append(file_path)
+                    
+                    # Count file types
+                    ext = os.path.splitext(file_name)[1].lower()
+                    if ext:
+                        file_types[ext] = file_types.get(ext, 0) + 1
     
     # Generate summary
     structure["summary"] = {
@@ -323,10 +268,50 @@ def analyze_project_structure(project_path):
     
     return structure
 
+def encode_structure_table(structure):
+    """
+    Compact form of a project structure with every directory path stored
+    once: `dirs` holds [parent index, name] pairs (the root is index 0 and
+    parents always come first), and `files[i]` the file names in dirs[i]
+    """
+    if "error" in structure:
+        return structure
+
+    dir_index = {"": 0}
+    dirs = [[-1, ""]]
+    files = [[]]
+
+    def intern(path):
+        index = dir_index.get(path)
+        if index is None:
+            parent, name = os.path.split(path)
+            parent_index = intern(parent)
+            index = dir_index[path] = len(dirs)
+            dirs.append([parent_index, name])
+            files.append([])
+        return index
+
+    for dir_path in structure["directories"]:
+        intern(dir_path)
+    for file_path in structure["files"]:
+        parent, name = os.path.split(file_path)
+        files[intern(parent)].append(name)
+
+    return {
+        "encoding": "dir-table",
+        "dirs": dirs,
+        "files": files,
+        "summary": structure["summary"]
+    }
+
 def analyze_dependencies(project_path):
     """
     Analyze project dependencies
     """
+    with timed("disk"):
+        return _read_dependencies(project_path)
+
+def _read_dependencies(project_path):
     dependencies = {"python": None, "javascript": None}
     
     # Check for Python dependencies
@@ -370,10 +355,14 @@ def create_zip_archive(files):
     Create a ZIP archive from a dictionary of files
     files should be a dict with {filename: content}
     """
+    import zipfile
+    from io import BytesIO
+
     zip_buffer = BytesIO()
-    with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
-        for file_path, content in files.items():
-            zip_file.writestr(file_path, content)
+    with timed("zip"):
+        with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
+            for file_path, content in files.items():
+                zip_file.writestr(file_path, content)
     
     zip_buffer.seek(0)
     
@@ -382,8 +371,9 @@ def create_zip_archive(files):
     os.makedirs(output_dir, exist_ok=True)
     
     zip_path = os.path.join(output_dir, f"project_{generate_unique_id()}.zip")
-    with open(zip_path, "wb") as f:
-        f.write(zip_buffer.getvalue())
+    with timed("disk"):
+        with open(zip_path, "wb") as f:
+            f.write(zip_buffer.getvalue())
     
     return zip_path
 